@@ -0,0 +1,68 @@
+"""
+Benchmarks for lcdblib.snakemake.helpers.
+
+Run with::
+
+    python benchmarks/bench_helpers.py
+"""
+import timeit
+from itertools import product
+
+import pandas as pd
+from snakemake.io import expand
+
+from lcdblib.snakemake import helpers
+
+
+def nested_patterns(n_leaves):
+    return {
+        'group%s' % i: {
+            'fastq': 'samples/{sample}/{sample}_R{N}.%s.fastq.gz' % i,
+            'bam': 'samples/{sample}/{sample}.%s.bam' % i,
+        }
+        for i in range(n_leaves // 2)
+    }
+
+
+def expand_fill_patterns(patterns, fill):
+    """
+    The previous implementation, for comparison.
+    """
+    def update(d, u):
+        for k, v in u.items():
+            if isinstance(v, dict):
+                d[k] = update(d.get(k, {}), v)
+            else:
+                d[k] = list(set(expand(v, zip, **fill.to_dict('list'))))
+        return d
+    return update({}, patterns)
+
+
+def main():
+    patterns = nested_patterns(200)
+    fill = pd.DataFrame({
+        'sample': ['sample%s' % i for i in range(5000)],
+        'N': [1, 2] * 2500,
+    })
+
+    for label, func in [
+        ('expand', lambda: expand_fill_patterns(patterns, fill)),
+        ('fill_patterns', lambda: helpers.fill_patterns(patterns, fill)),
+    ]:
+        t = min(timeit.repeat(func, number=1, repeat=3))
+        print('{0:<40} {1:8.3f} s'.format(label + ' (200 leaves, 5k rows)', t))
+
+    fill = dict(a=list(range(200)), b=list(range(200)), c=list(range(100)))
+    pattern = {'p': '{a}/{b}/{c}.txt'}
+    for label, kwargs in [
+        ('product, serial', {}),
+        ('product, 4 processes', dict(processes=4)),
+    ]:
+        t = min(timeit.repeat(
+            lambda: helpers.fill_patterns(pattern, fill, product, **kwargs),
+            number=1, repeat=3))
+        print('{0:<40} {1:8.3f} s'.format(label + ' (4M)', t))
+
+
+if __name__ == '__main__':
+    main()
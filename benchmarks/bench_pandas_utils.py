@@ -0,0 +1,101 @@
+"""
+Benchmarks for lcdblib.pandas.utils.
+
+Run with::
+
+    python benchmarks/bench_pandas_utils.py
+"""
+import time
+from itertools import product
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lcdblib.pandas import utils
+
+
+def stack_tidy_dataframe(df, column, sep='|'):
+    """
+    The previous implementation, for comparison.
+    """
+    s = df[column].str.split(sep, expand=True).stack()
+    i = s.index.get_level_values(0)
+    df2 = df.loc[i].copy()
+    df2[column] = s.values
+    return df2
+
+
+def iterrows_cartesian_product(df1, df2):
+    """
+    The previous implementation, for comparison. Requires pandas < 2.0 for
+    Series.append.
+    """
+    rows = product(df1.iterrows(), df2.iterrows())
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        df = pd.DataFrame(
+            left.append(right) for (_, left), (_, right) in rows)
+    return df.reset_index(drop=True)
+
+
+def measure(func, *args, **kwargs):
+    """
+    Returns (seconds, peak MB allocated) for calling func.
+    """
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def annotation_table(nrows, max_ids, ncols=10, seed=0):
+    """
+    Most rows have a single ID, with a long tail of rows having up to
+    `max_ids`.
+    """
+    rng = np.random.RandomState(seed)
+    n = np.minimum(rng.geometric(0.6, size=nrows), max_ids)
+    n[rng.randint(0, nrows, size=max(1, nrows // 1000))] = max_ids
+    ids = ['|'.join('g%d' % j for j in range(i)) for i in n]
+    df = pd.DataFrame({'gene': ids})
+    for i in range(ncols):
+        df['col%d' % i] = rng.rand(nrows)
+    return df
+
+
+def report(label, results):
+    for name, (t, mb) in results:
+        print('{0:<35} {1:<10} {2:8.3f} s {3:10.1f} MB'.format(
+            label, name, t, mb))
+
+
+def main():
+    for nrows, max_ids in [(100000, 20), (200000, 300)]:
+        df = annotation_table(nrows, max_ids)
+        label = 'tidy_dataframe {0} rows, <={1} ids'.format(nrows, max_ids)
+        report(label, [
+            ('stack', measure(stack_tidy_dataframe, df, 'gene')),
+            ('repeat', measure(utils.tidy_dataframe, df, 'gene')),
+        ])
+
+    rng = np.random.RandomState(0)
+    for n1, n2 in [(1000, 10), (10000, 100)]:
+        df1 = pd.DataFrame({
+            'sample': ['s%d' % i for i in range(n1)],
+            'reads': rng.randint(0, 1000, n1)})
+        df2 = pd.DataFrame({'param': rng.rand(n2)})
+        label = 'cartesian_product {0} x {1}'.format(n1, n2)
+        results = [('repeat', measure(utils.cartesian_product, df1, df2))]
+        if n1 * n2 <= 10000 and hasattr(pd.Series, 'append'):
+            results.insert(
+                0, ('iterrows', measure(iterrows_cartesian_product, df1, df2)))
+        report(label, results)
+
+
+if __name__ == '__main__':
+    main()
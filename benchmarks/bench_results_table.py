@@ -0,0 +1,68 @@
+"""
+Benchmarks for lcdblib.plotting.results_table.
+
+Run with::
+
+    python benchmarks/bench_results_table.py
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from lcdblib.plotting import results_table
+
+
+def loop_radviz_coordinates(df):
+    """
+    The previous implementation, for comparison (with `iloc` in place of the
+    removed `irow`).
+    """
+    df = df.apply(lambda s: (s - s.min()) / (s.max() - s.min()))
+    n = df.shape[1]
+    s = np.array([(np.cos(t), np.sin(t))
+                  for t in [2.0 * np.pi * (i / float(n)) for i in range(n)]])
+    to_plot = []
+    for i in range(len(df)):
+        row = df.iloc[i].values
+        row_ = np.repeat(np.expand_dims(row, axis=1), 2, axis=1)
+        to_plot.append((s * row_).sum(axis=0) / row.sum())
+    return np.array(to_plot)
+
+
+def measure(func, *args, **kwargs):
+    """
+    Returns (seconds, peak MB allocated) for calling func.
+    """
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def report(label, results):
+    for name, (t, mb) in results:
+        print('{0:<35} {1:<10} {2:8.3f} s {3:10.1f} MB'.format(
+            label, name, t, mb))
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for nrows in [100000, 300000, 1000000]:
+        df = pd.DataFrame(rng.rand(nrows, 6),
+                          columns=['col%d' % i for i in range(6)])
+        label = 'radviz {0} rows x 6'.format(nrows)
+        results = [('vectorized', measure(
+            results_table._radviz_coordinates, df.values))]
+        # The row loop takes minutes beyond this size
+        if nrows <= 100000:
+            results.insert(0, ('loop', measure(loop_radviz_coordinates, df)))
+        report(label, results)
+
+
+if __name__ == '__main__':
+    main()
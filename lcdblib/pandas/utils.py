@@ -1,5 +1,6 @@
+import numpy as np
 import pandas as pd
-from itertools import product
+from itertools import chain
 
 def tidy_dataframe(df, column, sep='|'):
     """
@@ -23,14 +24,46 @@ def tidy_dataframe(df, column, sep='|'):
         # 2   g4      9
         # 2   g5      9
         # 2   g6      9
+
+    `column` can also be a list of columns, in which case they are split in
+    parallel and must have the same number of values in each row::
+
+               gene   symbol  score
+        0     g1|g2    A|B        1
+        1        g3      C        5
+
+    becomes::
+
+        tidy_dataframe(df, ['gene', 'symbol'], sep='|')
+        #   gene symbol  score
+        # 0   g1      A      1
+        # 0   g2      B      1
+        # 1   g3      C      5
+
+    Rows where `column` is missing are dropped.
     """
-    s = df[column].str.split(sep, expand=True).stack()
-    i = s.index.get_level_values(0)
-    df2 = df.loc[i].copy()
-    df2[column] = s.values
+    columns = [column] if isinstance(column, str) else list(column)
+
+    # Lists of values for each row; rows that are NaN stay NaN.
+    split = [df[c].str.split(sep) for c in columns]
+    lengths = split[0].str.len().fillna(0).astype(int).values
+    for c, s in zip(columns[1:], split[1:]):
+        other = s.str.len().fillna(0).astype(int).values
+        if (other != lengths).any():
+            raise ValueError(
+                "Columns '{0}' and '{1}' have different numbers of values "
+                "in some rows".format(columns[0], c))
+
+    # Repeat each row by position, so neither duplicate index labels nor
+    # label-based lookups are involved.
+    df2 = df.take(np.repeat(np.arange(len(df)), lengths))
+    keep = lengths > 0
+    for c, s in zip(columns, split):
+        df2[c] = list(chain.from_iterable(s.values[keep]))
     return df2
 
-def cartesian_product(df1, df2):
+
+def cartesian_product(df1, df2, chunksize=None):
     """ Calculates the carteisan product and returns expanded DataFrame.
 
     Given a pandas.DataFrame::
@@ -49,20 +82,182 @@ def cartesian_product(df1, df2):
         | two    | testis | 100 |
         | two    | testis | 200 |
 
+    Column dtypes of both inputs are retained.
+
     Parameters
     ----------
     df1: pandas.DataFrame
         A DataFrame that you want to expand.
     df2: dict of array-like | pandas.DataFrame | pandas.Series
         The set of values that you want to expand df1 by.
+    chunksize: int or None
+        If not None, return an iterator of DataFrames each with at most this
+        many rows (but always at least one row of `df1` expanded by all of
+        `df2`) rather than building the entire product at once.
+
+    """
+    if isinstance(df2, dict):
+        df2 = pd.DataFrame(df2)
+    elif isinstance(df2, pd.Series):
+        df2 = df2.to_frame()
+
+    if chunksize is not None:
+        return _cartesian_product_chunks(df1, df2, chunksize)
+    return _cartesian_product(df1, df2)
+
+
+def _cartesian_product(df1, df2, start=0):
+    """
+    Each row of `df1` repeated len(df2) times alongside `df2` tiled len(df1)
+    times. The result has a RangeIndex beginning at `start`.
+    """
+    n1, n2 = len(df1), len(df2)
+    left = df1.take(np.repeat(np.arange(n1), n2))
+    right = df2.take(np.tile(np.arange(n2), n1))
+    index = pd.RangeIndex(start, start + n1 * n2)
+    left.index = index
+    right.index = index
+    return pd.concat([left, right], axis=1)
+
+
+def _cartesian_product_chunks(df1, df2, chunksize):
+    rows = max(1, chunksize // max(1, len(df2)))
+    for i in range(0, len(df1), rows):
+        yield _cartesian_product(
+            df1.iloc[i:i + rows], df2, start=i * len(df2))
+
+
+def tidy_dataframe_chunks(chunks, column, sep='|'):
+    """
+    Chunked version of `tidy_dataframe`.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        For example, the result of ``pd.read_csv(fn, chunksize=100000)``.
+
+    column, sep :
+        Passed to `tidy_dataframe`.
+
+    Yields
+    ------
+    A tidied DataFrame for each chunk.
+    """
+    for chunk in chunks:
+        yield tidy_dataframe(chunk, column, sep=sep)
+
+
+def cartesian_product_chunks(chunks, df2, chunksize=None):
+    """
+    Chunked version of `cartesian_product`, where `df1` is provided in
+    chunks.
 
+    The index of the yielded DataFrames continues from one chunk to the next,
+    so concatenating them gives the same result as `cartesian_product` on the
+    entire `df1`.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        Chunks of `df1`, for example the result of
+        ``pd.read_csv(fn, chunksize=100000)``.
+
+    df2 : dict of array-like | pandas.DataFrame | pandas.Series
+        The set of values that you want to expand each chunk by. This is
+        expected to fit in memory.
+
+    chunksize : int or None
+        If not None, further split the product of each chunk into
+        DataFrames of at most this many rows.
     """
     if isinstance(df2, dict):
         df2 = pd.DataFrame(df2)
     elif isinstance(df2, pd.Series):
         df2 = df2.to_frame()
 
-    rows = product(df1.iterrows(), df2.iterrows())
-    df = pd.DataFrame(left.append(right) for (_, left), (_, right) in rows)
+    start = 0
+    for chunk in chunks:
+        if chunksize is None:
+            yield _cartesian_product(chunk, df2, start=start)
+        else:
+            for result in _cartesian_product_chunks(chunk, df2, chunksize):
+                result.index = result.index + start
+                yield result
+        start += len(chunk) * len(df2)
+
+
+def write_chunks(chunks, filename, fmt=None, index=True, **kwargs):
+    """
+    Write an iterable of DataFrames to a single file, one chunk at a time.
+
+    Together with `tidy_dataframe_chunks` or `cartesian_product_chunks` this
+    allows files larger than memory to be transformed::
+
+        chunks = pd.read_csv('annotations.tsv', sep='\\t', chunksize=500000)
+        write_chunks(
+            tidy_dataframe_chunks(chunks, 'gene'), 'tidy.parquet')
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        All chunks should have the same columns.
+
+    filename : str
+        Output file.
+
+    fmt : None or str
+        One of "parquet", "csv", or "tsv". If None, detected from the
+        extension of `filename` (ignoring any .gz or .bz2), defaulting to
+        "csv". Writing Parquet requires pyarrow.
+
+    index : bool
+        Whether to write the index.
+
+    Additional kwargs are passed to DataFrame.to_csv.
+
+    Returns
+    -------
+    Total number of rows written.
+    """
+    if fmt is None:
+        ext = filename
+        for compression in ('.gz', '.bz2'):
+            if ext.endswith(compression):
+                ext = ext[:-len(compression)]
+        ext = ext.rsplit('.', 1)[-1].lower()
+        fmt = {'parquet': 'parquet', 'pq': 'parquet', 'tsv': 'tsv'}.get(
+            ext, 'csv')
+
+    nrows = 0
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=index)
+                    writer = pq.ParquetWriter(filename, table.schema)
+                else:
+                    # Use the first chunk's schema so that, e.g., a column
+                    # that happens to be all-missing in a chunk still matches.
+                    table = pa.Table.from_pandas(
+                        chunk, schema=writer.schema, preserve_index=index)
+                writer.write_table(table)
+                nrows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return nrows
+
+    if fmt == 'tsv':
+        kwargs.setdefault('sep', '\t')
+    elif fmt != 'csv':
+        raise ValueError("Unsupported format '{0}'".format(fmt))
 
-    return df.reset_index(drop=True)
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(
+            filename, mode='w' if i == 0 else 'a', header=i == 0,
+            index=index, **kwargs)
+        nrows += len(chunk)
+    return nrows
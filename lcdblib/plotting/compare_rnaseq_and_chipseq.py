@@ -219,9 +219,12 @@ def plot(de_results, regions=None, peaks=None, selected=None, x='baseMean',
             )
         )
 
+        up_table, dn_table, ch_table = fisher.table_from_bool_matrix(
+            selected_genes, np.column_stack([up, dn, ch])).tolist()
+
         output.write(
             fisher.fisher_tables(
-                table=fisher.table_from_bool(selected_genes, up),
+                table=up_table,
                 row_names=row_names,
                 col_names=['upregulated', 'not'],
                 title='Upregulated (lfc>{0}; padj<{1})'.format(lfc_cutoff, alpha)))
@@ -229,7 +232,7 @@ def plot(de_results, regions=None, peaks=None, selected=None, x='baseMean',
         output.write('\n\n')
         output.write(
             fisher.fisher_tables(
-                table=fisher.table_from_bool(selected_genes, dn),
+                table=dn_table,
                 row_names=row_names,
                 col_names=['downregulated', 'not'],
                 title='Downregulated (lfc<-{0}; padj<{1})'.format(lfc_cutoff, alpha)))
@@ -237,7 +240,7 @@ def plot(de_results, regions=None, peaks=None, selected=None, x='baseMean',
         output.write('\n\n')
         output.write(
             fisher.fisher_tables(
-                table=fisher.table_from_bool(selected_genes, ch),
+                table=ch_table,
                 row_names=row_names,
                 col_names=['changed', 'not'],
                 title='Changed (lfc<-{0}; padj<{1})'.format(lfc_cutoff, alpha)))
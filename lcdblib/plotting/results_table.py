@@ -1,3 +1,13 @@
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from textwrap import dedent
 import numpy as np
 import pandas
@@ -11,6 +21,7 @@ from matplotlib.collections import EventCollection
 import gffutils
 import pybedtools
 from pybedtools import featurefuncs
+from scipy.spatial import cKDTree
 
 from .. utils import utils
 from . import colormap_adjust
@@ -34,9 +45,368 @@ db : string or gffutils.FeatureDB
 
 import_kwargs : dict
     These arguments will be passed to pandas.read_table() if `data` is
-    a filename.
+    a filename. If "usecols" is a list of column names and "index_col" is
+    set, the index column is always read as well.
+
+cache : None, "feather", or "parquet"
+    If `data` is a filename, store the parsed table in this format next to
+    it, in a file named after the source and a hash of its modification
+    time and the import options. Later loads with the same options read
+    that file (memory-mapped) instead of parsing text. Requires pyarrow.
+
+float_dtype : None or dtype
+    If not None, float columns are converted to this dtype (e.g.,
+    "float32") after loading a file.
 """
 
+_de_doc = _base_doc + """
+stats_dtype : None or dtype
+    Alias for `float_dtype`, e.g., "float32" to halve the memory used by
+    the statistics columns.
+
+usecols : None or list
+    Names of the only columns to read (the index is always read). Should
+    include the pval, lfc, and mean columns used by this class.
+"""
+
+def _inplace_methods():
+    names = set()
+    for name in dir(pandas.DataFrame):
+        if name.startswith('_'):
+            continue
+        value = getattr(pandas.DataFrame, name)
+        if not callable(value):
+            continue
+        try:
+            if 'inplace' in inspect.signature(value).parameters:
+                names.add(name)
+        except (TypeError, ValueError):
+            pass
+    return frozenset(names)
+
+
+# DataFrame methods that modify it in place when called with inplace=True
+_INPLACE_METHODS = _inplace_methods()
+
+# DataFrame attributes that can always modify it in place
+_MUTATING_ATTRS = frozenset(['loc', 'iloc', 'at', 'iat', 'insert', 'pop'])
+
+# Name given to an unnamed index when writing feather files, which only
+# support a default index.
+_INDEX_NAME = '__index_level_0__'
+
+
+def _cache_filename(filename, fmt, import_kwargs, float_dtype):
+    key = json.dumps(
+        [os.stat(filename).st_mtime_ns, import_kwargs, str(float_dtype)],
+        sort_keys=True, default=repr)
+    return '%s.%s.%s' % (
+        filename, hashlib.md5(key.encode()).hexdigest()[:12], fmt)
+
+
+def _read_cache(filename, fmt):
+    if fmt == 'parquet':
+        return pandas.read_parquet(filename, memory_map=True)
+    from pyarrow import feather
+    data = feather.read_feather(filename, memory_map=True)
+    data = data.set_index(data.columns[0])
+    if data.index.name == _INDEX_NAME:
+        data.index.name = None
+    return data
+
+
+def _write_cache(data, filename, fmt):
+    try:
+        if fmt == 'parquet':
+            data.to_parquet(filename)
+        else:
+            data.rename_axis(data.index.name or _INDEX_NAME)\
+                .reset_index().to_feather(filename)
+    except OSError as e:
+        warnings.warn('Could not write cache file %s: %s' % (filename, e))
+
+
+def _read_table(filename, import_kwargs=None, cache=None, float_dtype=None):
+    """
+    Loads `filename` with pandas.read_table, optionally converting float
+    columns and caching the result as feather or parquet. See `_base_doc`
+    for the arguments.
+    """
+    import_kwargs = dict(import_kwargs or {})
+    if cache not in (None, 'feather', 'parquet'):
+        raise ValueError("`cache` must be None, 'feather', or 'parquet'")
+    if cache:
+        cache_fn = _cache_filename(
+            filename, cache, import_kwargs, float_dtype)
+        if os.path.exists(cache_fn):
+            return _read_cache(cache_fn, cache)
+
+    usecols = import_kwargs.get('usecols')
+    if (
+        usecols is not None and not callable(usecols) and
+        import_kwargs.get('index_col') is not None and
+        all(isinstance(i, str) for i in usecols)
+    ):
+        # With a list of names, the index column has to be listed too but
+        # its name is unknown. Read the header to find it. An empty header
+        # field is named by pandas, and a missing one (as in DESeq2 output)
+        # is never passed to `usecols`.
+        header_kwargs = dict(import_kwargs, nrows=0)
+        header_kwargs.pop('usecols')
+        index_name = pandas.read_table(filename, **header_kwargs).index.name
+        index_col = import_kwargs['index_col']
+        keep = set(usecols)
+        if index_name is not None:
+            keep.add(index_name)
+        elif isinstance(index_col, int):
+            keep.add('Unnamed: %d' % index_col)
+        import_kwargs['usecols'] = keep.__contains__
+
+    data = pandas.read_table(filename, **import_kwargs)
+    if float_dtype is not None:
+        data = data.astype({
+            k: float_dtype for k, v in data.dtypes.items() if v.kind == 'f'})
+    if cache:
+        _write_cache(data, cache_fn, cache)
+    return data
+
+
+# Maximum total size of the feature coordinates kept in memory, in bytes
+COORDINATE_CACHE_BYTES = 2 ** 29
+
+# (path, mtime_ns, featuretypes) -> (DataFrame, bytes), least recently used
+# first
+_coordinate_cache = OrderedDict()
+_coordinate_cache_lock = threading.Lock()
+
+_COORDINATE_QUERY = (
+    'SELECT id, seqid AS chrom, start - 1 AS start, end, strand '
+    'FROM features')
+
+
+def _query_coordinates(conn, featuretypes):
+    if featuretypes is None:
+        return pandas.read_sql_query(
+            _COORDINATE_QUERY, conn, index_col='id')
+    return pandas.read_sql_query(
+        _COORDINATE_QUERY + ' WHERE featuretype IN (%s)'
+        % ', '.join('?' * len(featuretypes)),
+        conn, params=list(featuretypes), index_col='id')
+
+
+def _db_coordinates(dbfn, mtime_ns, sidecar, featuretypes):
+    """
+    Coordinates of the features of types `featuretypes` (all features if
+    None) in the db `dbfn`, from the in-memory cache if possible. `mtime_ns`
+    is part of the cache key, so that a modified db is read again.
+    """
+    key = (dbfn, mtime_ns, featuretypes)
+    with _coordinate_cache_lock:
+        if key in _coordinate_cache:
+            _coordinate_cache.move_to_end(key)
+            return _coordinate_cache[key][0]
+
+    coords = None
+    if sidecar:
+        fn = '%s.%d.%scoordinates.parquet' % (
+            dbfn, mtime_ns,
+            '' if featuretypes is None else
+            hashlib.md5(json.dumps(featuretypes).encode()).hexdigest()[:12]
+            + '.')
+        if os.path.exists(fn):
+            coords = pandas.read_parquet(fn)
+    if coords is None:
+        conn = sqlite3.connect(dbfn)
+        try:
+            coords = _query_coordinates(conn, featuretypes)
+        finally:
+            conn.close()
+        if sidecar:
+            coords.to_parquet(fn)
+
+    size = coords.memory_usage(deep=True).sum()
+    if size > COORDINATE_CACHE_BYTES:
+        return coords
+    with _coordinate_cache_lock:
+        _coordinate_cache[key] = (coords, size)
+        total = sum(i[1] for i in _coordinate_cache.values())
+        while total > COORDINATE_CACHE_BYTES:
+            _, (_, dropped) = _coordinate_cache.popitem(last=False)
+            total -= dropped
+    return coords
+
+
+def clear_coordinate_cache():
+    """
+    Empty the in-memory cache used by `db_coordinates`.
+    """
+    with _coordinate_cache_lock:
+        _coordinate_cache.clear()
+
+
+def db_coordinates(db, sidecar=False, featuretype=None):
+    """
+    Coordinates of features in a gffutils database, as a DataFrame indexed
+    by feature ID with columns "chrom", "start" (0-based, like BED), "end",
+    and "strand".
+
+    Results are kept in a process-wide LRU cache, keyed by path,
+    modification time, and `featuretype`, so that all ResultsTable objects
+    using the same db share one lookup. Least recently used results are
+    dropped once the cache holds more than `COORDINATE_CACHE_BYTES`. The
+    returned DataFrame is shared and should not be modified in place.
+
+    Parameters
+    ----------
+    db : str or gffutils.FeatureDB
+        Database filename, or a FeatureDB. In-memory databases are queried
+        every time.
+
+    sidecar : bool
+        If True, also store the coordinates in a Parquet file next to the
+        db, named after the db and its modification time, and use it if it
+        already exists. Requires pyarrow or fastparquet.
+
+    featuretype : str or list or None
+        Only get coordinates of features of these types (e.g., "gene"). For
+        databases created from GTF files, which have many more exons than
+        genes, this makes the lookup much smaller. By default, all features
+        are used.
+    """
+    if isinstance(featuretype, str):
+        featuretype = [featuretype]
+    if featuretype is not None:
+        featuretype = tuple(sorted(set(featuretype)))
+    dbfn = db if isinstance(db, str) else db.dbfn
+    if not isinstance(dbfn, str) or dbfn == ':memory:':
+        return _query_coordinates(db.conn, featuretype)
+    dbfn = os.path.abspath(dbfn)
+    return _db_coordinates(
+        dbfn, os.stat(dbfn).st_mtime_ns, bool(sidecar), featuretype)
+
+
+def _density_bins(x, y, valid, gridsize):
+    """
+    Assigns every valid (x, y) point to a bin of a regular grid spanning the
+    valid points.
+
+    Returns (xedges, yedges, ix, iy), where `ix` and `iy` are the bin numbers
+    of each point (-1 for invalid points).
+    """
+    if np.isscalar(gridsize):
+        gridsize = (gridsize, gridsize)
+    valid = np.asarray(valid)
+    edges, codes = [], []
+    for values, n in zip((x, y), gridsize):
+        values = np.asarray(values, dtype=float)
+        lo, hi = values[valid].min(), values[valid].max()
+        if hi == lo:
+            lo, hi = lo - 0.5, hi + 0.5
+        edges.append(np.linspace(lo, hi, n + 1))
+        code = np.full(len(values), -1, dtype=np.intp)
+        code[valid] = np.minimum(
+            ((values[valid] - lo) * (n / (hi - lo))).astype(np.intp), n - 1)
+        codes.append(code)
+    return edges[0], edges[1], codes[0], codes[1]
+
+
+def _marginal_counts(bins, ind):
+    """
+    Counts per x bin and per y bin of the points in boolean index `ind`,
+    using the bins from `_density_bins`.
+    """
+    xedges, yedges, ix, iy = bins
+    ind = np.asarray(ind)
+    return (
+        np.bincount(ix[ind], minlength=len(xedges) - 1),
+        np.bincount(iy[ind], minlength=len(yedges) - 1),
+    )
+
+
+def _radviz_coordinates(values):
+    """
+    Radviz projection of a 2D array of observations x variables.
+
+    Each variable is scaled to 0-1 and placed at an anchor evenly spaced around
+    the unit circle; each row is then the weighted average of the anchors.
+    Returns (xy, anchors), each with two columns. Rows whose scaled values sum
+    to zero have no defined position and are NaN in `xy`.
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.shape[1]
+    t = 2.0 * np.pi * np.arange(n) / n
+    anchors = np.column_stack([np.cos(t), np.sin(t)])
+    mn = values.min(axis=0)
+    rng = values.max(axis=0) - mn
+    # A constant variable pulls on nothing rather than making every row NaN
+    rng[rng == 0] = 1
+    weights = (values - mn) / rng
+    total = weights.sum(axis=1)
+    empty = total == 0
+    total[empty] = 1
+    xy = (weights @ anchors) / total[:, None]
+    xy[empty] = np.nan
+    return xy, anchors
+
+
+class _FastPicker(object):
+    def __init__(self, ax, xy, ids):
+        """
+        Finds the points of a fast scatter near a click, using a KD-tree.
+
+        Parameters
+        ----------
+        ax : matplotlib.Axes
+            Axes the points were drawn on
+
+        xy : array
+            Data coordinates of the points, one row per point
+
+        ids : pandas.Index
+            ID of each point
+        """
+        self.ax = ax
+        self.xy = xy
+        self.ids = ids
+        # Build the tree in scale coordinates (e.g., log10 of data for a log
+        # axis), normalized so neither axis dominates distances.
+        scaled = ax.transScale.transform(xy) if len(xy) else xy
+        self.offset = scaled.min(axis=0) if len(xy) else np.zeros(2)
+        self.norm = np.ptp(scaled, axis=0) if len(xy) else np.ones(2)
+        self.norm[self.norm == 0] = 1
+        self.tree = cKDTree((scaled - self.offset) / self.norm)
+
+    def pick(self, px, py, pickradius=5):
+        """
+        IDs of points within `pickradius` pixels of display coordinates
+        (px, py), nearest first.
+        """
+        ax = self.ax
+        if len(self.xy) == 0:
+            return []
+        click = ax.transData.inverted().transform([[px, py]])
+        click = (ax.transScale.transform(click) - self.offset) / self.norm
+
+        # Size of one pixel in tree coordinates, along each axis, at the
+        # current view. Query with the larger radius, then filter candidates
+        # by their actual distance in pixels.
+        (x0, y0), (x1, y1) = ax.transScale.transform(
+            [[ax.get_xlim()[0], ax.get_ylim()[0]],
+             [ax.get_xlim()[1], ax.get_ylim()[1]]])
+        per_pixel = np.abs(
+            [(x1 - x0) / ax.bbox.width, (y1 - y0) / ax.bbox.height]
+        ) / self.norm
+        candidates = self.tree.query_ball_point(
+            click[0], pickradius * per_pixel.max())
+        if not candidates:
+            return []
+        candidates = np.asarray(candidates)
+        pixels = ax.transData.transform(self.xy[candidates])
+        dist = np.hypot(pixels[:, 0] - px, pixels[:, 1] - py)
+        keep = dist <= pickradius
+        candidates = candidates[keep][np.argsort(dist[keep], kind='stable')]
+        return list(pandas.unique(self.ids[candidates]))
+
 
 class ResultsTable(object):
     __doc__ = _base_doc % dedent(
@@ -44,28 +414,151 @@ class ResultsTable(object):
         Wrapper around a pandas.DataFrame that adds additional functionality.
         """)
 
-    def __init__(self, data, db=None, import_kwargs=None):
+    def __init__(self, data, db=None, import_kwargs=None, cache=None,
+                 float_dtype=None):
         if isinstance(data, str):
-            import_kwargs = import_kwargs or {}
-            data = pandas.read_table(data, **import_kwargs)
+            data = _read_table(data, import_kwargs, cache, float_dtype)
         if not isinstance(data, pandas.DataFrame):
             raise ValueError("`data` is not a pandas.DataFrame")
         self.data = data
 
-        self._kwargs = dict(db=db, import_kwargs=import_kwargs)
+        self._kwargs = dict(db=db, import_kwargs=import_kwargs, cache=cache,
+                            float_dtype=float_dtype)
         self.attach_db(db)
-        self._cached_features = None
+
+    @property
+    def data(self):
+        """
+        The underlying pandas.DataFrame.
+
+        Subsets and copies of a ResultsTable are lazy: they share their
+        parent's DataFrame and only record which rows they use. Reading
+        columns or DataFrame attributes through the ResultsTable itself (e.g.,
+        `r.baseMean`, `r['baseMean']`, `r.loc`) never copies a shared
+        DataFrame, so changes should always be made through `data`: the first
+        access to `data` gives the instance its own DataFrame, so changes made
+        to it never affect other instances.
+        """
+        if self._rows is not None:
+            self._base = self._base.take(self._rows)
+            self._rows = None
+            self._owner = True
+        elif not self._owner:
+            self._base = self._base.copy()
+            self._owner = True
+        return self._base
+
+    @data.setter
+    def data(self, value):
+        self._base = value
+        self._rows = None
+        self._owner = True
+
+    def _frame(self):
+        """
+        Read-only DataFrame of this instance's rows, which may be shared with
+        other instances.
+        """
+        if self._rows is not None:
+            # Keep the rows taken for a subset, so that further reads don't
+            # take them again. The new DataFrame is not shared.
+            self._base = self._base.take(self._rows)
+            self._rows = None
+            self._owner = True
+        return self._base
+
+    def _index(self):
+        if self._rows is not None:
+            return self._base.index.take(self._rows)
+        return self._base.index
+
+    def _column(self, name):
+        """
+        Read-only Series of this instance's rows of column `name`, without
+        creating the whole DataFrame.
+        """
+        col = self._base[name]
+        if self._rows is not None:
+            col = col.take(self._rows)
+        return col
+
+    def _public_column(self, name):
+        """
+        Column `name` as returned to users. Columns of a DataFrame shared
+        with other instances are copied, so that changes to them don't reach
+        the other instances.
+        """
+        col = self._column(name)
+        if self._rows is None and not self._owner:
+            col = col.copy()
+        return col
+
+    def _subset(self, rows=None):
+        """
+        New instance sharing this instance's DataFrame, restricted to
+        positions `rows` (all rows if None).
+        """
+        if self._rows is not None:
+            rows = self._rows if rows is None else self._rows[rows]
+        else:
+            # The DataFrame is now shared, so copy it before handing it out
+            # from `data` again.
+            self._owner = False
+        new = self.__class__(self._base, **self._kwargs)
+        new._rows = rows
+        new._owner = False
+        return new
+
+    def _reindex(self, labels):
+        """
+        New instance with rows for `labels`. If every label is in a unique
+        index, this is a lazy subset; otherwise the DataFrame is reindexed,
+        with NaN rows for missing labels.
+        """
+        index = self._index()
+        if index.is_unique:
+            rows = index.get_indexer(labels)
+            if (rows >= 0).all():
+                return self._subset(rows)
+        return self.__class__(self._frame().reindex(labels), **self._kwargs)
 
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return getattr(self, attr)
-        return getattr(self.data, attr)
+        # Only called when normal lookup fails. Private names and `data`
+        # itself are never looked up in the DataFrame, which avoids infinite
+        # recursion before __init__ has run (e.g., when unpickling).
+        if attr.startswith('_') or attr == 'data':
+            raise AttributeError(attr)
+        if attr == 'index':
+            return self._index()
+        if attr in self._base.columns:
+            return self._public_column(attr)
+        if attr in _MUTATING_ATTRS:
+            # Could be used for writing, so never hand out a shared frame
+            return getattr(self.data, attr)
+        if attr in _INPLACE_METHODS:
+            def method(*args, **kwargs):
+                frame = self.data if kwargs.get('inplace') else self._frame()
+                return getattr(frame, attr)(*args, **kwargs)
+            method.__doc__ = getattr(pandas.DataFrame, attr).__doc__
+            return method
+        return getattr(self._frame(), attr)
 
     def __getitem__(self, attr):
         if isinstance(attr, str):
-            return self.data.__getitem__(attr)
-        else:
-            return self.__class__(self.data.__getitem__(attr), **self._kwargs)
+            return self._public_column(attr)
+        if isinstance(attr, slice) and all(
+            i is None or isinstance(i, (int, np.integer))
+            for i in (attr.start, attr.stop, attr.step)
+        ):
+            return self._subset(np.arange(len(self))[attr])
+        if isinstance(attr, pandas.Series):
+            if attr.dtype == bool and attr.index.equals(self._index()):
+                return self._subset(np.flatnonzero(attr.values))
+        elif isinstance(attr, (np.ndarray, list)):
+            mask = np.asarray(attr)
+            if mask.dtype == bool and mask.shape == (len(self),):
+                return self._subset(np.flatnonzero(mask))
+        return self.__class__(self._frame().__getitem__(attr), **self._kwargs)
 
     def update(self, dataframe):
         """
@@ -77,15 +570,18 @@ class ResultsTable(object):
         return self.__class__(dataframe, **self._kwargs)
 
     def copy(self):
-        data = self.data.copy(deep=True)
-        return self.__class__(data, db=self.db, import_kwargs=self._kwargs)
+        """
+        Returns a copy. The DataFrame itself is only copied once either
+        instance's `data` is accessed.
+        """
+        return self._subset()
 
     def __repr__(self):
         s = []
         s.append("<%s instance, wrapping the following:"
                  % self.__class__.__name__)
         s.append('')
-        s.extend('\t' + i for i in repr(self.data).splitlines(False))
+        s.extend('\t' + i for i in repr(self._frame()).splitlines(False))
         s.append('>')
         return '\n'.join(s)
 
@@ -108,29 +604,162 @@ class ResultsTable(object):
                     "`db` must be a filename or a gffutils.FeatureDB")
         self._kwargs['db'] = db
         self.db = db
+        self._cached_features = None
 
-    def features(self, ignore_unknown=False):
+    def _feature_rows(self, columns=None, chunksize=900):
         """
-        Generator of features.
+        Generator of (feature ID, sqlite3.Row or None) for every item in the
+        dataframe's index, in order.
 
-        If a gffutils.FeatureDB is attached, returns a pybedtools.Interval for
-        every feature in the dataframe's index.
+        IDs are looked up in chunks with a single `IN (...)` query per chunk
+        rather than one query per ID. `chunksize` is kept below SQLite's
+        default limit on the number of host parameters.
+
+        Parameters
+        ----------
+        columns : None or str
+            Columns to select from the features table. If None, select
+            everything needed to build a gffutils.Feature.
+        """
+        if not self.db:
+            raise ValueError("Please attach a gffutils.FeatureDB")
+        if columns is None:
+            select = gffutils.constants._SELECT
+        else:
+            select = 'SELECT id, %s FROM features' % columns
+        index = self._index()
+        c = self.db.conn.cursor()
+        for start in range(0, len(index), chunksize):
+            chunk = index[start:start + chunksize]
+            ids = list(pandas.unique(chunk))
+            c.execute(
+                select + ' WHERE id IN (%s)' % ','.join('?' * len(ids)),
+                ids)
+            rows = {row['id']: row for row in c.fetchall()}
+            for i in chunk:
+                yield i, rows.get(i)
+
+    def features(self, ignore_unknown=False, bedtool=False, chunksize=900,
+                 bed=False):
+        """
+        Features for every item in the dataframe's index.
+
+        If a gffutils.FeatureDB is attached, returns a generator of
+        pybedtools.Interval objects, one for every feature in the dataframe's
+        index. Features are fetched from the db in chunks of `chunksize` IDs.
 
         Parameters
         ----------
         ignore_unknown : bool
             If True, silently ignores features that are not found in the db.
+
+        bedtool : bool
+            If True, return a pybedtools.BedTool instead of a generator.
+
+        bed : bool
+            If True, create BED6 intervals (name is the feature ID, score is
+            0) from the cached coordinates (see `feature_coordinates`)
+            instead of full GFF features from the db.
         """
         if not self.db:
             raise ValueError("Please attach a gffutils.FeatureDB")
-        for i in self.data.index:
-            try:
-                yield gffutils.helpers.asinterval(self.db[i])
-            except gffutils.FeatureNotFoundError:
-                if ignore_unknown:
-                    continue
-                else:
+
+        def gen():
+            for i, row in self._feature_rows(chunksize=chunksize):
+                if row is None:
+                    if ignore_unknown:
+                        continue
                     raise gffutils.FeatureNotFoundError('%s not found' % i)
+                yield gffutils.helpers.asinterval(
+                    self.db._feature_returner(**row))
+
+        def bed_gen(coords):
+            for i, chrom, start, end, strand in coords.itertuples():
+                yield pybedtools.create_interval_from_list(
+                    [chrom, str(start), str(end), str(i), '0', strand])
+
+        if bed:
+            intervals = bed_gen(self.feature_coordinates(
+                ignore_unknown=ignore_unknown, chunksize=chunksize))
+        else:
+            intervals = gen()
+        if bedtool:
+            return pybedtools.BedTool(list(intervals))
+        return intervals
+
+    def _coordinates(self, chunksize=900, sidecar=False, featuretype=None):
+        """
+        Coordinates for the dataframe's index, with NaN for features not
+        in the db.
+        """
+        if not self.db:
+            raise ValueError("Please attach a gffutils.FeatureDB")
+        if isinstance(self.db.dbfn, str) and self.db.dbfn != ':memory:':
+            return db_coordinates(
+                self.db, sidecar, featuretype).reindex(self._index())
+
+        chrom, start, end, strand = [], [], [], []
+        for i, row in self._feature_rows(
+                columns='seqid, start, end, strand', chunksize=chunksize):
+            if row is None:
+                row = dict(seqid=np.nan, start=np.nan, end=np.nan,
+                           strand=np.nan)
+            else:
+                row = dict(row)
+                row['start'] -= 1
+            chrom.append(row['seqid'])
+            start.append(row['start'])
+            end.append(row['end'])
+            strand.append(row['strand'])
+        return pandas.DataFrame(
+            dict(chrom=chrom, start=start, end=end, strand=strand),
+            index=self._index(),
+            columns=['chrom', 'start', 'end', 'strand'])
+
+    def feature_coordinates(self, ignore_unknown=False, chunksize=900,
+                            sidecar=False, featuretype=None):
+        """
+        Coordinates of every feature in the dataframe's index, without
+        creating any intervals.
+
+        For file-backed databases, coordinates come from the shared cache in
+        `db_coordinates`; otherwise they are fetched in chunks of `chunksize`
+        IDs. Either way they are kept on this instance for later calls.
+
+        Parameters
+        ----------
+        ignore_unknown : bool
+            If True, features not found in the db are dropped. Otherwise
+            a gffutils.FeatureNotFoundError is raised.
+
+        sidecar, featuretype
+            Passed to `db_coordinates`. `featuretype` is ignored for
+            databases that are not file-backed.
+
+        Returns
+        -------
+        pandas.DataFrame with the same index as the data and columns "chrom",
+        "start" (0-based, like BED), "end", and "strand".
+        """
+        cached = self._cached_features
+        if (
+            cached is None or cached[0] != featuretype or
+            not cached[1].index.equals(self._index())
+        ):
+            coords = self._coordinates(chunksize=chunksize, sidecar=sidecar,
+                                       featuretype=featuretype)
+            self._cached_features = (featuretype, coords)
+        else:
+            coords = cached[1]
+        missing = coords['chrom'].isnull().values
+        if missing.any():
+            if not ignore_unknown:
+                raise gffutils.FeatureNotFoundError(
+                    '%s not found' % coords.index[missing][0])
+            coords = coords[~missing].astype(dict(start=int, end=int))
+        else:
+            coords = coords.copy()
+        return coords
 
     def reindex_to(self, x, attribute=None):
         """
@@ -165,18 +794,23 @@ class ResultsTable(object):
                 attribute = 'name'
             names = [getattr(i, attribute) for i in x]
 
-        new = self.copy()
-        new.data = new.data.reindex(names)
-        return new
+        return self._reindex(names)
 
     def align_with(self, other):
         """
-        Align the dataframe's index with another.
+        Align the dataframe's index and columns with another, like
+        pandas.DataFrame.reindex_like.
         """
-        return self.__class__(self.data.reindex_like(other), **self._kwargs)
+        if other.columns.equals(self._base.columns):
+            return self._reindex(other.index)
+        return self.__class__(
+            self._frame().reindex(index=other.index, columns=other.columns),
+            **self._kwargs)
 
     def __len__(self):
-        return len(self.data)
+        if self._rows is not None:
+            return len(self._rows)
+        return len(self._base)
 
     def scatter(self, x, y, xfunc=None, yfunc=None, xscale=None, yscale=None,
                 xlab=None, ylab=None, genes_to_highlight=None,
@@ -185,7 +819,9 @@ class ResultsTable(object):
                 general_hist_kwargs=None, offset_kwargs={}, label_kwargs=None,
                 ax=None, one_to_one=None, callback=None, hist_size=0.3,
                 hist_pad=0.0, nan_offset=0.015, pos_offset=0.99,
-                linelength=0.01, neg_offset=0.005):
+                linelength=0.01, neg_offset=0.005, fast=False,
+                rasterize_threshold=50000, pickradius=5, density=False,
+                gridsize=256, density_cmap=None, density_backend='numpy'):
         """
         Do-it-all method for making annotated scatterplots.
 
@@ -198,7 +834,8 @@ class ResultsTable(object):
         ----------
 
         x, y : array-like
-            Variables to plot.  Must be names in self.data's DataFrame.
+            Variables to plot.  Must be names in self.data's DataFrame, or
+            pandas.Series with the same index as self.data.
 
         xfunc, yfunc : callable
             Functions to apply to `xvar` and `yvar` respectively. If xlab or
@@ -313,9 +950,61 @@ class ResultsTable(object):
         linelength : float
             Line length for the rug plots
 
+        fast : bool
+            If True, merge all blocks (general and highlighted) that share
+            a style into a single collection, without matplotlib's artist
+            picking; clicked points are instead found with a KD-tree. Only
+            "color", "alpha", "s", "marker", and "label" are used from the
+            scatter kwargs, and blocks with the same style are drawn at the
+            position of the first one. Marginal histograms are not supported
+            in this mode. Use for large tables. The KD-tree is available as
+            the returned axes' `fast_picker` attribute.
+
+        rasterize_threshold : int
+            When `fast` is True, rasterize the points if there are more than
+            this many.
+
+        pickradius : float
+            When `fast` is True, clicking selects points within this many
+            pixels.
+
+        density : bool
+            If True, the points that are not in `genes_to_highlight` are
+            binned into a 2D histogram that is drawn as an image (with
+            a log color scale), and only the highlighted points are drawn
+            individually. Marginal histograms are computed from the same
+            bins. Only the highlighted points can be clicked. Use for
+            millions of points.
+
+        gridsize : int or tuple
+            When `density` is True, number of bins along x and y, or
+            a (nx, ny) tuple.
+
+        density_cmap : None or matplotlib colormap
+            When `density` is True, colormap for the image. Default is to
+            fade from transparent to the color in `general_kwargs`.
+
+        density_backend : "numpy" or "datashader"
+            When `density` is True, how to bin the image's points.
+            "datashader" requires the datashader package.
+
         """
-        _x = self.data[x]
-        _y = self.data[y]
+        if fast and density:
+            raise ValueError("Only one of `fast` and `density` can be True")
+        if fast and (marginal_histograms or any(
+                len(block) > 1 and block[1].get('marginal_histograms')
+                for block in (genes_to_highlight or []))):
+            raise ValueError(
+                "Marginal histograms are not supported with fast=True")
+
+        if isinstance(x, pandas.Series):
+            _x, x = x, x.name
+        else:
+            _x = self._column(x)
+        if isinstance(y, pandas.Series):
+            _y, y = y, y.name
+        else:
+            _y = self._column(y)
 
         # Construct defaults---------------------------------------------------
         def identity(x):
@@ -443,7 +1132,10 @@ class ResultsTable(object):
         # upregulated AND has a peak), here we keep track of everything that's
         # been added so far.
         self._seen = np.ones_like(xi) == 0
-        for block in _genes_to_highlight:
+        fast_blocks = []
+        if density:
+            bins = _density_bins(xi, yi, x_valid & y_valid, gridsize)
+        for i, block in enumerate(_genes_to_highlight):
             ind = block[0]
             kwargs = block[1]
 
@@ -473,24 +1165,43 @@ class ResultsTable(object):
 
             # MarginalHistScatter does most of the actual plotting work.
             scatter_ind = ind & x_valid & y_valid
-            self.marginal.append(
-                xi[scatter_ind],
-                yi[scatter_ind],
-                scatter_kwargs=dict(**updated_kwargs),
-                hist_kwargs=updated_hist_kwargs,
-                xhist_kwargs=xhist_kwargs,
-                yhist_kwargs=yhist_kwargs,
-                marginal_histograms=_marginal_histograms,
-            )
+            if density:
+                xcounts, ycounts = _marginal_counts(bins, scatter_ind)
+                if _marginal_histograms:
+                    self.marginal.append_binned(
+                        bins[0], xcounts, bins[1], ycounts,
+                        hist_kwargs=updated_hist_kwargs,
+                        xhist_kwargs=xhist_kwargs,
+                        yhist_kwargs=yhist_kwargs,
+                    )
 
-            # Callback functions have access to the Collection object that was
-            # picked as well as the index into the collection. Since ultimately
-            # we want to access a row of the dataframe, to the collection we
-            # attach the dataframe itself and the index into that dataframe
-            # represented by the scatter points in the collection.
-            coll = self.marginal.scatter_ax.collections[-1]
-            coll.df = self.data
-            coll.ind = scatter_ind
+            if density and i == 0:
+                self._density_image(
+                    ax, xi, yi, scatter_ind, bins, updated_kwargs,
+                    density_cmap, density_backend)
+            elif fast:
+                # Drawn all at once after the loop
+                fast_blocks.append((scatter_ind, updated_kwargs))
+            else:
+                self.marginal.append(
+                    xi[scatter_ind],
+                    yi[scatter_ind],
+                    scatter_kwargs=dict(**updated_kwargs),
+                    hist_kwargs=updated_hist_kwargs,
+                    xhist_kwargs=xhist_kwargs,
+                    yhist_kwargs=yhist_kwargs,
+                    marginal_histograms=_marginal_histograms and not density,
+                )
+
+                # Callback functions have access to the Collection object
+                # that was picked as well as the index into the collection.
+                # Since ultimately we want to access a row of the dataframe,
+                # to the collection we attach the dataframe itself and the
+                # index into that dataframe represented by the scatter points
+                # in the collection.
+                coll = self.marginal.scatter_ax.collections[-1]
+                coll.df = self._frame()
+                coll.ind = scatter_ind
 
             color = color_converter(updated_kwargs['color'])
             rug_x_kwargs['color'] = color
@@ -522,7 +1233,7 @@ class ResultsTable(object):
                 # provide np.array rather than pandas.Series
                 coll = EventCollection(
                     values[index].values, lineoffset=offset, **kwargs)
-                coll.df = self.data
+                coll.df = self._frame()
                 coll.ind = index
                 ax.add_collection(coll)
 
@@ -550,8 +1261,23 @@ class ResultsTable(object):
             for _id in self._id_callback(event):
                 callback(_id)
 
-        # Connect the callback.
-        ax.figure.canvas.mpl_connect('pick_event', wrapped_callback)
+        if fast:
+            # Each plot keeps its own picker, so that several fast scatters of
+            # the same table (e.g., on different subplots) don't interfere.
+            picker = self._fast_scatter(
+                ax, xi, yi, fast_blocks, rasterize_threshold)
+            ax.fast_picker = picker
+
+            def fast_callback(event):
+                if event.inaxes is not ax or event.button != 1:
+                    return
+                for _id in picker.pick(event.x, event.y, pickradius):
+                    callback(_id)
+
+            ax.figure.canvas.mpl_connect('button_press_event', fast_callback)
+        else:
+            # Connect the callback.
+            ax.figure.canvas.mpl_connect('pick_event', wrapped_callback)
 
         ax.set_xlabel(xlab)
         ax.set_ylabel(ylab)
@@ -572,7 +1298,7 @@ class ResultsTable(object):
         represents the equilibrium position with all springs pulling on it.
 
         In practice, each variable is normalized to 0-1 (by subtracting the
-        mean and dividing by the range).
+        minimum and dividing by the range).
 
         This is a very exploratory plot.  The order of `column_names` will
         affect the results, so it's best to try a couple different orderings.
@@ -607,9 +1333,10 @@ class ResultsTable(object):
 
         Notes
         -----
-        This method adds two new variables to self.data: "radviz_x" and
-        "radviz_y".  It then calls the self.scatter method, using these new
-        variables.
+        The projected coordinates are passed to self.scatter as Series named
+        "radviz_x" and "radviz_y"; self.data is not modified.  Rows whose
+        normalized values are all zero have no defined position and are not
+        plotted.
 
         The data transformation was adapted from the
         pandas.tools.plotting.radviz function.
@@ -622,37 +1349,16 @@ class ResultsTable(object):
         2. http://www.agocg.ac.uk/reports/visual/casestud/brunsdon/radviz.htm
         3. http://pandas.pydata.org/pandas-docs/stable/visualization.html#radviz
         """
-        # make a copy of data
-        x = self.data[column_names].copy()
+        x = self._frame()[column_names].astype(float)
 
         for k, v in transforms.items():
             x[k] = v(x[k])
 
-        def normalize(series):
-            mn = min(series)
-            mx = max(series)
-            return (series - mn) / (mx - mn)
-
-        df = x.apply(normalize)
-
-        to_plot = []
-
-        n = len(column_names)
-
-        s = np.array([(np.cos(t), np.sin(t))
-                      for t in [2.0 * np.pi * (i / float(n))
-                                for i in range(n)]])
-
-        for i in range(len(x)):
-            row = df.irow(i).values
-            row_ = np.repeat(np.expand_dims(row, axis=1), 2, axis=1)
-            to_plot.append((s * row_).sum(axis=0) / row.sum())
+        xy, s = _radviz_coordinates(x.values)
+        radviz_x = pandas.Series(xy[:, 0], index=x.index, name='radviz_x')
+        radviz_y = pandas.Series(xy[:, 1], index=x.index, name='radviz_y')
 
-        x_, y_ = zip(*to_plot)
-        self.data['radviz_x'] = x_
-        self.data['radviz_y'] = y_
-
-        ax = self.scatter('radviz_x', 'radviz_y', **kwargs)
+        ax = self.scatter(radviz_x, radviz_y, **kwargs)
 
         ax.add_patch(patches.Circle((0.0, 0.0), radius=1.0, facecolor='none'))
         for xy, name in zip(s, column_names):
@@ -678,18 +1384,93 @@ class ResultsTable(object):
         #
         # event.artist.ind is the index of the entire artist into the original
         # dataframe.
-        subset_df = event.artist.df.ix[event.artist.ind]
+        subset_df = event.artist.df[event.artist.ind]
         for i in event.ind:
             _id = subset_df.index[i]
             yield _id
 
     def _default_callback(self, i):
-        print(self.data.ix[i])
+        print(self._frame().loc[i])
+
+    def _density_image(self, ax, xi, yi, ind, bins, kwargs, cmap, backend):
+        """
+        Draws the points in boolean index `ind` as a 2D histogram image on the
+        grid in `bins` (from `_density_bins`).
+        """
+        xedges, yedges, ix, iy = bins
+        ind = np.asarray(ind)
+        nx, ny = len(xedges) - 1, len(yedges) - 1
+        if backend == 'datashader':
+            import datashader
+            canvas = datashader.Canvas(
+                plot_width=nx, plot_height=ny,
+                x_range=(xedges[0], xedges[-1]),
+                y_range=(yedges[0], yedges[-1]))
+            points = pandas.DataFrame(dict(
+                x=np.asarray(xi, dtype=float)[ind],
+                y=np.asarray(yi, dtype=float)[ind]))
+            counts = np.asarray(canvas.points(points, 'x', 'y')).T
+        elif backend == 'numpy':
+            counts = np.bincount(
+                ix[ind] * ny + iy[ind], minlength=nx * ny).reshape(nx, ny)
+        else:
+            raise ValueError(
+                "`density_backend` must be 'numpy' or 'datashader'")
+
+        if cmap is None:
+            color = matplotlib.colors.to_rgba(kwargs.get('color', 'k'))
+            cmap = matplotlib.colors.LinearSegmentedColormap.from_list(
+                'density', [color[:3] + (0.1,), color[:3] + (1,)])
+        image = np.ma.masked_equal(counts.T, 0)
+        norm = matplotlib.colors.LogNorm(vmin=1, vmax=max(counts.max(), 2))
+        self.density_image = ax.imshow(
+            image, origin='lower', aspect='auto', interpolation='nearest',
+            extent=(xedges[0], xedges[-1], yedges[0], yedges[-1]),
+            cmap=cmap, norm=norm, zorder=kwargs.get('zorder', 1))
+        self.density_counts = counts
+
+    def _fast_scatter(self, ax, xi, yi, blocks, rasterize_threshold):
+        """
+        Draws the (boolean index, scatter kwargs) `blocks` of a fast scatter
+        with one collection per distinct style, and returns a `_FastPicker`
+        for the drawn points.
+        """
+        default_size = matplotlib.rcParams['lines.markersize'] ** 2
+        groups = OrderedDict()
+        for ind, kwargs in blocks:
+            pos = np.flatnonzero(np.asarray(ind))
+            style = (
+                kwargs.get('marker', matplotlib.rcParams['scatter.marker']),
+                matplotlib.colors.to_rgba(
+                    kwargs.get('color', 'k'), kwargs.get('alpha')),
+                kwargs.get('s', default_size),
+            )
+            groups.setdefault(style, []).append(pos)
+            if kwargs.get('label') is not None:
+                # Empty proxy so the block still shows up in legends
+                ax.scatter([], [], color=style[1], marker=style[0],
+                           s=style[2], label=kwargs['label'])
+
+        xi = np.asarray(xi, dtype=float)
+        yi = np.asarray(yi, dtype=float)
+        n = sum(len(p) for group in groups.values() for p in group)
+        all_pos = []
+        for (marker, color, size), pos in groups.items():
+            pos = np.concatenate(pos)
+            # A uniform color and size lets backends draw every point with
+            # the same marker, which is much faster than per-point styles.
+            ax.scatter(xi[pos], yi[pos], color=[color], s=size, marker=marker,
+                       rasterized=n > rasterize_threshold)
+            all_pos.append(pos)
+        pos = np.concatenate(all_pos) if all_pos else np.array([], dtype=int)
+
+        return _FastPicker(ax, np.column_stack([xi[pos], yi[pos]]),
+                           self._index()[pos])
 
 
 class DifferentialExpressionResults(ResultsTable):
 
-    __doc__ = _base_doc % dedent("""
+    __doc__ = _de_doc % dedent("""
     A ResultsTable subclass for working with differential expression results.
 
     Adds methods for up/down regulation, ma_plot, and sets class variables for
@@ -701,8 +1482,13 @@ class DifferentialExpressionResults(ResultsTable):
     lfc_column = 'log2FoldChange'
     mean_column = 'baseMean'
 
-    def __init__(self, data, db=None, header_check=True, **kwargs):
-        import_kwargs = kwargs.pop('import_kwargs', {})
+    def __init__(self, data, db=None, header_check=True, stats_dtype=None,
+                 usecols=None, **kwargs):
+        import_kwargs = dict(kwargs.pop('import_kwargs', None) or {})
+        if stats_dtype is not None:
+            kwargs['float_dtype'] = stats_dtype
+        if usecols is not None:
+            import_kwargs['usecols'] = list(usecols)
         if header_check and isinstance(data, str):
             comment_char = import_kwargs.get('comment', '#')
             import_kwargs['comment'] = comment_char
@@ -729,8 +1515,8 @@ class DifferentialExpressionResults(ResultsTable):
             will be returned that has been subsetted.
         """
         ind = (
-            (self.data[self.pval_column] <= alpha) &
-            (np.abs(self.data[self.lfc_column]) >= lfc)
+            (self._column(self.pval_column) <= alpha) &
+            (np.abs(self._column(self.lfc_column)) >= lfc)
         )
 
         if idx:
@@ -754,7 +1540,7 @@ class DifferentialExpressionResults(ResultsTable):
             If True, a boolean index will be returned.  If False, a new object
             will be returned that has been subsetted.
         """
-        ind = ~self.changed(alpha, lfc, idx)
+        ind = ~self.changed(alpha, lfc)
         if idx:
             return ind
         return self[ind]
@@ -777,8 +1563,8 @@ class DifferentialExpressionResults(ResultsTable):
             will be returned that has been subsetted.
         """
         ind = (
-            (self.data[self.pval_column] <= alpha) &
-            (self.data[self.lfc_column] >= lfc)
+            (self._column(self.pval_column) <= alpha) &
+            (self._column(self.lfc_column) >= lfc)
         )
         if idx:
             return ind
@@ -802,13 +1588,102 @@ class DifferentialExpressionResults(ResultsTable):
             will be returned that has been subsetted.
         """
         ind = (
-            (self.data[self.pval_column] <= alpha) &
-            (self.data[self.lfc_column] <= lfc)
+            (self._column(self.pval_column) <= alpha) &
+            (self._column(self.lfc_column) <= lfc)
         )
         if idx:
             return ind
         return self[ind]
 
+    def threshold_summary(self, alphas, lfcs, index=False):
+        """
+        Numbers of upregulated, downregulated, and changed features for every
+        combination of thresholds.
+
+        Each feature is assigned to a bin of `alphas` and a bin of `lfcs`
+        once; counts for all combinations then come from cumulative sums of
+        the resulting 2D histogram, rather than rescanning the data for each
+        threshold.
+
+        Parameters
+        ----------
+        alphas : list-like
+            pval thresholds
+
+        lfcs : list-like
+            Non-negative log2foldchange thresholds. For a threshold `t`, the
+            counts are those of `upregulated(alpha, t)`,
+            `downregulated(alpha, -t)`, and `changed(alpha, t)`.
+
+        index : bool
+            If True, also return the features themselves.
+
+        Returns
+        -------
+        A pandas.DataFrame with columns "alpha", "lfc", "up", "down", and
+        "changed", with one row for each combination of `alphas` and `lfcs`
+        (in that order). If `index` is True, a tuple of that DataFrame and
+        a dict mapping (alpha, lfc) to a dict of "up", "down", and "changed"
+        pandas.Index objects.
+        """
+        alphas = np.asarray(alphas, dtype=float).ravel()
+        lfcs = np.asarray(lfcs, dtype=float).ravel()
+        pval = self._column(self.pval_column).values
+        lfc = self._column(self.lfc_column).values
+
+        # Sorted unique thresholds, and where each requested one is in them
+        a_sorted, a_inv = np.unique(alphas, return_inverse=True)
+        t_sorted, t_inv = np.unique(lfcs, return_inverse=True)
+
+        # A feature passes alpha bin k and above...
+        ok = ~(np.isnan(pval) | np.isnan(lfc))
+        k = np.searchsorted(a_sorted, pval[ok], side='left')
+        shape = (len(a_sorted) + 1, len(t_sorted) + 1)
+
+        counts = {}
+        for kind, x in [
+            ('up', lfc[ok]),
+            ('down', -lfc[ok]),
+            ('changed', np.abs(lfc[ok])),
+        ]:
+            # ...and lfc bin m and below (m = 0 passes none)
+            m = np.searchsorted(t_sorted, x, side='right')
+            hist = np.bincount(
+                k * shape[1] + m, minlength=shape[0] * shape[1]
+            ).reshape(shape)
+            cum = hist.cumsum(axis=0)[:, ::-1].cumsum(axis=1)[:, ::-1]
+            counts[kind] = cum[:-1, 1:]
+
+        a_idx = np.repeat(a_inv, len(lfcs))
+        t_idx = np.tile(t_inv, len(alphas))
+        summary = pandas.DataFrame(dict(
+            alpha=np.repeat(alphas, len(lfcs)),
+            lfc=np.tile(lfcs, len(alphas)),
+            up=counts['up'][a_idx, t_idx],
+            down=counts['down'][a_idx, t_idx],
+            changed=counts['changed'][a_idx, t_idx],
+        ), columns=['alpha', 'lfc', 'up', 'down', 'changed'])
+        if not index:
+            return summary
+
+        # Features passing each alpha are a prefix of those sorted by pval
+        names = self._index()[ok]
+        order = np.argsort(pval[ok], kind='stable')
+        sorted_p = pval[ok][order]
+        sorted_lfc = lfc[ok][order]
+        sets = {}
+        for alpha in alphas:
+            n = np.searchsorted(sorted_p, alpha, side='right')
+            prefix = order[:n]
+            x = sorted_lfc[:n]
+            for t in lfcs:
+                sets[(alpha, t)] = dict(
+                    up=names[np.sort(prefix[x >= t])],
+                    down=names[np.sort(prefix[x <= -t])],
+                    changed=names[np.sort(prefix[np.abs(x) >= t])],
+                )
+        return summary, sets
+
     def ma_plot(self, alpha, up_kwargs=None, dn_kwargs=None,
                 zero_line=None, **kwargs):
         """
@@ -858,7 +1733,7 @@ class DifferentialExpressionResults(ResultsTable):
 
 
 class EdgeRResults(DifferentialExpressionResults):
-    __doc__ = _base_doc % dedent(
+    __doc__ = _de_doc % dedent(
         """
         Class for working with results from edgeR.
 
@@ -872,7 +1747,7 @@ class EdgeRResults(DifferentialExpressionResults):
 
 
 class DESeqResults(DifferentialExpressionResults):
-    __doc__ = _base_doc % dedent(
+    __doc__ = _de_doc % dedent(
         """
         Class for working with results from DESeq.
 
@@ -899,32 +1774,26 @@ class DESeqResults(DifferentialExpressionResults):
         """
         if self.db is None:
             raise ValueError("FeatureDB required")
-        db = gffutils.FeatureDB(self.db)
+        coords = self.feature_coordinates()
 
         def scored_feature_generator(d):
-            for i in range(len(d)):
-                try:
-                    feature = db[d.ix[i]]
-                except gffutils.FeatureNotFoundError:
-                    raise gffutils.FeatureNotFoundError(d.ix[i])
-                score = -10 * np.log10(d.padj[i])
-                lfc = d.log2FoldChange[i]
+            for i, (chrom, start, end, strand) in enumerate(
+                    coords.itertuples(index=False)):
+                score = -10 * np.log10(d.padj.iloc[i])
+                lfc = d.log2FoldChange.iloc[i]
                 if np.isnan(lfc):
                     score = 0
                 if lfc < 0:
                     score *= -1
-                feature.score = str(score)
-                feature = featurefuncs.extend_fields(
-                    featurefuncs.gff2bed(
-                        gffutils.helpers.asinterval(feature)), 9)
-                fields = feature.fields[:]
-                fields[6] = fields[1]
-                fields[7] = fields[2]
-                fields.append(str(d.padj[i]))
-                fields.append(str(d.pval[i]))
-                fields.append('%.3f' % d.log2FoldChange[i])
-                fields.append('%.3f' % d.baseMeanB[i])
-                fields.append('%.3f' % d.baseMeanB[i])
+                fields = [
+                    chrom, str(start), str(end), str(coords.index[i]),
+                    str(score), strand, str(start), str(end), '.',
+                    str(d.padj.iloc[i]),
+                    str(d.pval.iloc[i]),
+                    '%.3f' % d.log2FoldChange.iloc[i],
+                    '%.3f' % d.baseMeanA.iloc[i],
+                    '%.3f' % d.baseMeanB.iloc[i],
+                ]
                 yield pybedtools.create_interval_from_list(fields)
 
         x = pybedtools.BedTool(scored_feature_generator(self)).saveas()
@@ -985,7 +1854,7 @@ class DESeqResults(DifferentialExpressionResults):
 
 
 class DESeq2Results(DESeqResults):
-    __doc__ = _base_doc % dedent(
+    __doc__ = _de_doc % dedent(
         """
         Class for working with results from DESeq2.
 
@@ -1000,7 +1869,7 @@ class DESeq2Results(DESeqResults):
 
 class LazyDict(object):
     def __init__(self, fn_dict, index_file=None, index_from=None, extra=None,
-                 cls=DESeqResults):
+                 cls=DESeqResults, max_memory=None, threads=None):
         """
         Dictionary-like object that lazily-loads ResultsTable objects.
 
@@ -1034,11 +1903,27 @@ class LazyDict(object):
         cls : ResultsTable class or subclass
             Each filename in `fn_dict` will be converted using this class.
 
+        max_memory : int or None
+            If not None, the maximum number of bytes of loaded dataframes to
+            keep. When exceeded, the least recently used objects are dropped
+            and will be loaded again on next access. The most recently used
+            object is always kept.
+
+        threads : int or None
+            Number of threads used by `prefetch`, `values`, and `items` to
+            load files concurrently. If None, ThreadPoolExecutor's default is
+            used.
         """
         self.fn_dict = fn_dict
 
-        # this acts as the cache
-        self._dict = {}
+        # this acts as the cache, in least- to most-recently used order
+        self._dict = OrderedDict()
+        self._sizes = {}
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._executor = None
+        self.max_memory = max_memory
+        self.threads = threads
 
         if index_file is not None and index_from is not None:
             raise ValueError(
@@ -1054,20 +1939,98 @@ class LazyDict(object):
         self._cls = cls
 
     def _load(self, key):
-        return self._cls(self.fn_dict[key])
+        obj = self._cls(self.fn_dict[key])
+        if self.index is not None and key != self.index_from:
+            obj.data = obj.data.reindex(self.index)
+        return obj
+
+    def _ensure_index(self):
+        with self._lock:
+            if self.index is None and self.index_from is not None:
+                obj = self._load(self.index_from)
+                self.index = obj.index
+                self._store(self.index_from, obj)
+
+    def _store(self, key, obj):
+        """
+        Add a loaded object to the cache (unless it's already there) and
+        evict least recently used objects if needed.
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._dict:
+                return
+            self._dict[key] = obj
+            self._sizes[key] = obj._frame().memory_usage(deep=True).sum()
+            if self.max_memory is None:
+                return
+            while (
+                len(self._dict) > 1 and
+                sum(self._sizes.values()) > self.max_memory
+            ):
+                evicted, _ = self._dict.popitem(last=False)
+                del self._sizes[evicted]
+
+    def prefetch(self, keys=None):
+        """
+        Start loading `keys` (all keys if None) in background threads.
+        Already-loaded keys are skipped.
 
-    def __getitem__(self, key):
-        if self.index is None:
-            obj = self._load(self.index_from)
-            self._dict[self.index_from] = obj
-            self.index = obj.index
+        Returns a dict of key -> concurrent.futures.Future.
+        """
+        if keys is None:
+            keys = list(self.keys())
+        self._ensure_index()
+        futures = {}
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            for key in keys:
+                if key in self._dict:
+                    continue
+                future = self._pending.get(key)
+                if future is None:
+                    future = self._executor.submit(self._load, key)
+                    self._pending[key] = future
+                    # Runs immediately if the future is already done
+                    future.add_done_callback(
+                        partial(self._prefetched, key))
+                futures[key] = future
+        return futures
+
+    def _prefetched(self, key, future):
+        if future.exception() is None:
+            self._store(key, future.result())
+        else:
+            with self._lock:
+                self._pending.pop(key, None)
 
-        if key not in self._dict:
-            obj = self._load(key)
-            obj.data = obj.data.ix[self.index]
-            self._dict[key] = obj
+    def close(self):
+        """
+        Shut down the prefetching threads, if any.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
-        return self._dict[key]
+    def __getitem__(self, key):
+        if key not in self.fn_dict:
+            raise KeyError(key)
+        self._ensure_index()
+        with self._lock:
+            if key in self._dict:
+                self._dict.move_to_end(key)
+                return self._dict[key]
+            future = self._pending.get(key)
+        if future is not None:
+            obj = future.result()
+        else:
+            obj = self._load(key)
+        self._store(key, obj)
+        with self._lock:
+            if key in self._dict:
+                self._dict.move_to_end(key)
+        return obj
 
     def __repr__(self):
         s = "<%s> with possible keys\n:%s\n" \
@@ -1080,10 +2043,194 @@ class LazyDict(object):
         return self.fn_dict.keys()
 
     def values(self):
-        return [self._dict[key] for key in self.keys()]
+        """
+        All values, loading any missing ones concurrently.
+        """
+        return [value for key, value in self.items()]
 
     def items(self):
-        return list((key, self._dict[key]) for key in self.keys())
+        """
+        All (key, value) pairs, loading any missing values concurrently.
+
+        Values are taken directly from the loading threads, so each missing
+        value is loaded once even if `max_memory` is too small to keep them
+        all in the cache.
+        """
+        keys = list(self.keys())
+        self._ensure_index()
+        with self._lock:
+            # Taken together, so that nothing is evicted in between
+            loaded = {k: self._dict[k] for k in keys if k in self._dict}
+            futures = self.prefetch([k for k in keys if k not in loaded])
+        return [
+            (key, loaded[key] if key in loaded else futures[key].result())
+            for key in keys]
+
+
+class ContrastStore(object):
+    def __init__(self, pval, lfc, mean):
+        """
+        Differential expression results for many contrasts, stored as aligned
+        genes x contrasts DataFrames so that questions across contrasts can
+        be answered with vectorized operations.
+
+        For example, genes upregulated in at least 3 contrasts::
+
+            store.upregulated(alpha=0.05).sum(axis=1) >= 3
+
+        Parameters
+        ----------
+        pval, lfc, mean : pandas.DataFrame
+            Adjusted p-values, log2 fold changes, and mean expression, with
+            one row per gene and one column per contrast. They are aligned to
+            the index and columns of `pval`.
+        """
+        self.pval = pval
+        self.lfc = lfc.reindex(index=pval.index, columns=pval.columns)
+        self.mean = mean.reindex(index=pval.index, columns=pval.columns)
+
+    @classmethod
+    def from_results(cls, results, index=None):
+        """
+        Create a ContrastStore from DifferentialExpressionResults objects.
+
+        Parameters
+        ----------
+        results : dict
+            Maps contrast name to a DifferentialExpressionResults object (or
+            anything with `data`, `pval_column`, `lfc_column`, and
+            `mean_column` attributes, like the values of a LazyDict).
+
+        index : list-like or None
+            Genes to align all contrasts to. By default, the index of the
+            first contrast is used.
+        """
+        names = list(results.keys())
+        if index is None:
+            index = results[names[0]]._index() if names else []
+        index = pandas.Index(index)
+        arrays = {}
+        for field in ('pval', 'lfc', 'mean'):
+            dtypes = [
+                results[k]._column(getattr(results[k], field + '_column'))
+                .dtype for k in names]
+            # Always floating point, so that missing genes can be NaN
+            arrays[field] = np.empty(
+                (len(index), len(names)),
+                dtype=np.result_type(*dtypes, np.float32))
+        for j, k in enumerate(names):
+            obj = results[k]
+            data = obj._frame()
+            rows = data.index.get_indexer(index) \
+                if data.index.is_unique else None
+            for field in ('pval', 'lfc', 'mean'):
+                col = data[getattr(obj, field + '_column')]
+                if rows is None:
+                    values = col.reindex(index).values
+                else:
+                    values = col.values.take(rows)
+                    values = np.where(rows < 0, np.nan, values)
+                arrays[field][:, j] = values
+        columns = pandas.Index(names)
+        return cls(**{
+            k: pandas.DataFrame(v, index=index, columns=columns)
+            for k, v in arrays.items()})
+
+    @classmethod
+    def from_files(cls, fn_dict, index=None, results_class=None, **kwargs):
+        """
+        Create a ContrastStore by loading only the needed columns of each
+        file in `fn_dict` (contrast name -> filename).
+
+        Parameters
+        ----------
+        index : list-like or None
+            Passed to `from_results`
+
+        results_class : DifferentialExpressionResults subclass
+            Class used to load each file; DESeq2Results by default.
+
+        Additional kwargs (e.g., `stats_dtype` or `cache`) are passed to
+        `results_class`.
+        """
+        if results_class is None:
+            results_class = DESeq2Results
+        usecols = [
+            results_class.pval_column,
+            results_class.lfc_column,
+            results_class.mean_column,
+        ]
+        kwargs.setdefault('usecols', usecols)
+        return cls.from_results(
+            {k: results_class(v, **kwargs) for k, v in fn_dict.items()},
+            index=index)
+
+    @property
+    def index(self):
+        return self.pval.index
+
+    @property
+    def contrasts(self):
+        return self.pval.columns
+
+    def __len__(self):
+        return len(self.pval.columns)
+
+    def __repr__(self):
+        return '<%s: %d genes x %d contrasts>' % (
+            self.__class__.__name__, len(self.index), len(self.contrasts))
+
+    def __getitem__(self, contrast):
+        """
+        DataFrame with the pval, lfc, and mean columns of one contrast.
+        """
+        return pandas.DataFrame(dict(
+            pval=self.pval[contrast],
+            lfc=self.lfc[contrast],
+            mean=self.mean[contrast]))
+
+    def changed(self, alpha=0.1, lfc=0):
+        """
+        Boolean genes x contrasts DataFrame of where the pval is <= alpha and
+        the absolute value of the log2foldchange is >= lfc.
+        """
+        return (self.pval <= alpha) & (self.lfc.abs() >= lfc)
+
+    def unchanged(self, alpha=0.1, lfc=0):
+        """
+        Boolean genes x contrasts DataFrame; the inverse of `changed`.
+        """
+        return ~self.changed(alpha, lfc)
+
+    def upregulated(self, alpha=0.1, lfc=0):
+        """
+        Boolean genes x contrasts DataFrame of where the pval is <= alpha and
+        the log2foldchange is >= lfc.
+        """
+        return (self.pval <= alpha) & (self.lfc >= lfc)
+
+    def downregulated(self, alpha=0.1, lfc=0):
+        """
+        Boolean genes x contrasts DataFrame of where the pval is <= alpha and
+        the log2foldchange is <= lfc.
+        """
+        return (self.pval <= alpha) & (self.lfc <= lfc)
+
+    def save(self, filename):
+        """
+        Save to a single Parquet file. Requires pyarrow or fastparquet.
+        """
+        pandas.concat(
+            dict(pval=self.pval, lfc=self.lfc, mean=self.mean), axis=1
+        ).to_parquet(filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a ContrastStore saved with `save`.
+        """
+        df = pandas.read_parquet(filename, memory_map=True)
+        return cls(df['pval'], df['lfc'], df['mean'])
 
 
 class MarginalHistScatter(object):
@@ -1187,35 +2334,12 @@ class MarginalHistScatter(object):
         xhk = utils.updatecopy(hist_kwargs, xhist_kwargs)
         yhk = utils.updatecopy(hist_kwargs, yhist_kwargs)
 
-        axhistx = self.divider.append_axes(
-            'top', size=self.hist_size,
-            pad=self.pad, sharex=self.scatter_ax, sharey=self.xfirst_ax)
-
-        axhisty = self.divider.append_axes(
-            'right', size=self.hist_size,
-            pad=self.pad, sharey=self.scatter_ax, sharex=self.yfirst_ax)
-
-        axhistx.yaxis.set_major_locator(
-            MaxNLocator(nbins=num_ticks, prune='both'))
-
-        axhisty.xaxis.set_major_locator(
-            MaxNLocator(nbins=num_ticks, prune='both'))
-
-        if not self.xfirst_ax and hist_share:
-            self.xfirst_ax = axhistx
-
-        if not self.yfirst_ax and hist_share:
-            self.yfirst_ax = axhisty
-
-        # Keep track of which axes are which, because looking into fig.axes
-        # list will get awkward....
-        self.top_hists.append(axhistx)
-        self.right_hists.append(axhisty)
+        axhistx, axhisty = self._append_hist_axes(num_ticks, hist_share)
 
         # Scatter will deal with NaN, but hist will not.  So clean the data
         # here.
         hx = x[np.isfinite(x)]
-        hy = x[np.isfinite(y)]
+        hy = y[np.isfinite(y)]
 
         self.hxs.append(hx)
         self.hys.append(hy)
@@ -1238,6 +2362,40 @@ class MarginalHistScatter(object):
             else:
                 axhisty.hist(hy, **yhk)
 
+        self._hide_labels(axhistx, axhisty)
+
+    def _append_hist_axes(self, num_ticks=3, hist_share=False):
+        """
+        Borrows room from the scatter axes for a new pair of marginal
+        histogram axes, and returns them as (top, right).
+        """
+        axhistx = self.divider.append_axes(
+            'top', size=self.hist_size,
+            pad=self.pad, sharex=self.scatter_ax, sharey=self.xfirst_ax)
+
+        axhisty = self.divider.append_axes(
+            'right', size=self.hist_size,
+            pad=self.pad, sharey=self.scatter_ax, sharex=self.yfirst_ax)
+
+        axhistx.yaxis.set_major_locator(
+            MaxNLocator(nbins=num_ticks, prune='both'))
+
+        axhisty.xaxis.set_major_locator(
+            MaxNLocator(nbins=num_ticks, prune='both'))
+
+        if not self.xfirst_ax and hist_share:
+            self.xfirst_ax = axhistx
+
+        if not self.yfirst_ax and hist_share:
+            self.yfirst_ax = axhisty
+
+        # Keep track of which axes are which, because looking into fig.axes
+        # list will get awkward....
+        self.top_hists.append(axhistx)
+        self.right_hists.append(axhisty)
+        return axhistx, axhisty
+
+    def _hide_labels(self, axhistx, axhisty):
         # Turn off unnecessary labels -- for these, use the scatter's axes
         # labels
         for txt in axhisty.get_yticklabels() + axhistx.get_xticklabels():
@@ -1246,6 +2404,38 @@ class MarginalHistScatter(object):
         for txt in axhisty.get_xticklabels():
             txt.set_rotation(-90)
 
+    def append_binned(self, xedges, xcounts, yedges, ycounts,
+                      hist_kwargs=None, xhist_kwargs=None, yhist_kwargs=None,
+                      num_ticks=3, hist_share=False):
+        """
+        Adds marginal histograms from counts that have already been binned,
+        without a scatter.
+
+        Parameters
+        ----------
+        xedges, yedges : array-like
+            Bin edges along x and y
+
+        xcounts, ycounts : array-like
+            Counts in each bin, one fewer than the corresponding edges
+
+        Other arguments are as in `append`; any "bins" in the histogram
+        kwargs are ignored.
+        """
+        hist_kwargs = hist_kwargs or {}
+        xhk = utils.updatecopy(hist_kwargs, xhist_kwargs or {})
+        yhk = utils.updatecopy(hist_kwargs, yhist_kwargs or {})
+        yhk['orientation'] = 'horizontal'
+        xhk.pop('bins', None)
+        yhk.pop('bins', None)
+
+        axhistx, axhisty = self._append_hist_axes(num_ticks, hist_share)
+        self.hxs.append((xedges, xcounts))
+        self.hys.append((yedges, ycounts))
+        axhistx.hist(xedges[:-1], bins=xedges, weights=xcounts, **xhk)
+        axhisty.hist(yedges[:-1], bins=yedges, weights=ycounts, **yhk)
+        self._hide_labels(axhistx, axhisty)
+
     def add_legends(self, xhists=True, yhists=False, scatter=True, **kwargs):
         """
         Add legends to axes.
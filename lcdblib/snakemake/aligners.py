@@ -1,45 +1,81 @@
 """
 Helper functions for working with aligners within Snakefiles
 """
+import hashlib
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-def hisat2_index_from_prefix(prefix):
+
+# Regular expressions that, when removed from an index filename, leave the
+# prefix. Used for both single and batched prefix lookups.
+_PREFIX_REGEX = {
+    'hisat2': re.compile(r'\.[^.]*\.ht2l?$'),
+    'bowtie2': re.compile(r'(\.rev)?\.[^.]*\.bt2l?$'),
+    'bwa': re.compile(r'\.(amb|ann|bwt|pac|sa)$'),
+    'kallisto': re.compile(r'\.idx$'),
+    'star': re.compile(r'/?[^/]*$'),
+    'salmon': re.compile(r'/?[^/]*$'),
+}
+
+
+def _prefix_from_index(index_files, aligner):
+    """
+    Given a filename or list of filenames for an index, return the single
+    corresponding prefix.
+    """
+    regex = _PREFIX_REGEX[aligner]
+    if isinstance(index_files, str):
+        return regex.sub('', index_files, count=1)
+    prefixes = {regex.sub('', i, count=1) for i in index_files}
+    if len(prefixes) != 1:
+        raise ValueError(
+            "More than one prefix detected from '{0}'".format(
+                sorted(prefixes))
+        )
+    return prefixes.pop()
+
+
+def hisat2_index_from_prefix(prefix, large=False):
     """
     Given a prefix, return a list of the corresponding hisat2 index files.
+
+    If `large` is True, return the large-index (.ht2l) files instead.
     """
-    return ['{prefix}.{n}.ht2'.format(prefix=prefix, n=n) for n in range(1, 9)]
+    ext = 'ht2l' if large else 'ht2'
+    return [
+        '{prefix}.{n}.{ext}'.format(prefix=prefix, n=n, ext=ext)
+        for n in range(1, 9)
+    ]
 
 
 def prefix_from_hisat2_index(index_files):
     """
     Given a list of index files for hisat2, return the corresponding prefix.
     """
-    if isinstance(index_files, str):
-        return '.'.join(index_files.split('.')[:-2])
-    else:
-        prefixes = list(
-            set(
-                map(
-                    lambda x: '.'.join(x.split('.')[:-2]), index_files)
-            )
-        )
-        if len(prefixes) != 1:
-            raise ValueError(
-                "More than one prefix detected from '{0}'".format(prefixes)
-            )
-        return prefixes[0]
+    return _prefix_from_index(index_files, 'hisat2')
 
 
-def bowtie2_index_from_prefix(prefix):
+def bowtie2_index_from_prefix(prefix, large=False):
     """
     Given a prefix, return a list of the corresponding bowtie2 index files.
+
+    If `large` is True, return the large-index (.bt2l) files instead.
     """
+    ext = 'bt2l' if large else 'bt2'
     return (
         [
-            '{prefix}.{n}.bt2'.format(prefix=prefix, n=n)
+            '{prefix}.{n}.{ext}'.format(prefix=prefix, n=n, ext=ext)
             for n in range(1, 5)
         ] + [
-            '{prefix}.rev.{n}.bt2'.format(prefix=prefix, n=n)
+            '{prefix}.rev.{n}.{ext}'.format(prefix=prefix, n=n, ext=ext)
             for n in range(1, 3)
         ]
     )
@@ -49,18 +85,411 @@ def prefix_from_bowtie2_index(index_files):
     """
     Given a list of index files for bowtie2, return the corresponding prefix.
     """
-    if isinstance(index_files, str):
-        return '.'.join(index_files.replace('.rev', '').split('.')[:-2])
+    return _prefix_from_index(index_files, 'bowtie2')
+
+
+def bwa_index_from_prefix(prefix):
+    """
+    Given a prefix, return a list of the corresponding BWA index files.
+    """
+    return [
+        '{prefix}.{ext}'.format(prefix=prefix, ext=ext)
+        for ext in ['amb', 'ann', 'bwt', 'pac', 'sa']
+    ]
+
+
+def prefix_from_bwa_index(index_files):
+    """
+    Given a list of index files for BWA, return the corresponding prefix.
+    """
+    return _prefix_from_index(index_files, 'bwa')
+
+
+def kallisto_index_from_prefix(prefix):
+    """
+    Given a prefix, return a list containing the kallisto index file.
+    """
+    return ['{prefix}.idx'.format(prefix=prefix)]
+
+
+def prefix_from_kallisto_index(index_files):
+    """
+    Given the kallisto index file, return the corresponding prefix.
+    """
+    return _prefix_from_index(index_files, 'kallisto')
+
+
+def star_index_from_prefix(prefix):
+    """
+    Given an index directory, return a list of the corresponding STAR index
+    files.
+    """
+    return [
+        '{prefix}/{fn}'.format(prefix=prefix, fn=fn)
+        for fn in [
+            'Genome', 'SA', 'SAindex', 'chrLength.txt', 'chrName.txt',
+            'chrNameLength.txt', 'chrStart.txt', 'genomeParameters.txt',
+        ]
+    ]
+
+
+def prefix_from_star_index(index_files):
+    """
+    Given a list of index files for STAR, return the index directory.
+    """
+    return _prefix_from_index(index_files, 'star')
+
+
+def salmon_index_from_prefix(prefix):
+    """
+    Given an index directory, return a list of the corresponding salmon index
+    files.
+    """
+    return [
+        '{prefix}/{fn}'.format(prefix=prefix, fn=fn)
+        for fn in [
+            'ctable.bin', 'info.json', 'mphf.bin', 'pos.bin', 'refseq.bin',
+            'seq.bin', 'versionInfo.json',
+        ]
+    ]
+
+
+def prefix_from_salmon_index(index_files):
+    """
+    Given a list of index files for salmon, return the index directory.
+    """
+    return _prefix_from_index(index_files, 'salmon')
+
+
+def prefixes_from_index(index_files, aligner):
+    """
+    Resolve many lists of index files to their prefixes in a single pass.
+
+    Parameters
+    ----------
+    index_files : list or dict
+        Each item (or value, if a dict) is a filename or list of filenames
+        making up one index.
+
+    aligner : str
+        One of the keys of INDEX_FILES, e.g., "hisat2"
+
+    Returns
+    -------
+    List of prefixes in the same order as `index_files`, or a dict with the
+    same keys if `index_files` was a dict.
+
+    Raises ValueError if the files of any one item do not share a single
+    prefix.
+    """
+    if aligner not in _PREFIX_REGEX:
+        raise ValueError(
+            "Unsupported aligner '{0}'; choose from {1}"
+            .format(aligner, sorted(_PREFIX_REGEX)))
+    if isinstance(index_files, dict):
+        keys = list(index_files.keys())
+        lists = index_files.values()
     else:
-        prefixes = list(
-            set(
-                map(
-                    lambda x: '.'.join(x.replace('.rev', '').split('.')[:-2]),
-                    index_files)
-            )
-        )
-        if len(prefixes) != 1:
+        keys = None
+        lists = index_files
+
+    # Bind once; this loop may run over many thousands of files.
+    sub = _PREFIX_REGEX[aligner].sub
+    result = []
+    for files in lists:
+        if isinstance(files, str):
+            result.append(sub('', files, 1))
+            continue
+        prefixes = [sub('', i, 1) for i in files]
+        if not prefixes:
+            raise ValueError("Empty list of index files")
+        first = prefixes[0]
+        if prefixes.count(first) != len(prefixes):
             raise ValueError(
-                "More than one prefix detected from '{0}'".format(prefixes)
-            )
-        return prefixes[0]
+                "More than one prefix detected from '{0}'".format(
+                    sorted(set(prefixes))))
+        result.append(first)
+
+    if keys is not None:
+        return dict(zip(keys, result))
+    return result
+
+
+# Functions that, given a prefix, return the expected index files.
+INDEX_FILES = {
+    'hisat2': hisat2_index_from_prefix,
+    'bowtie2': bowtie2_index_from_prefix,
+    'bwa': bwa_index_from_prefix,
+    'kallisto': kallisto_index_from_prefix,
+    'star': star_index_from_prefix,
+    'salmon': salmon_index_from_prefix,
+}
+
+# Aligners whose index files function accepts `large`
+LARGE_INDEX = {'hisat2', 'bowtie2'}
+
+
+def _index_files(prefix, aligner, large=False):
+    if aligner not in INDEX_FILES:
+        raise ValueError(
+            "Unsupported aligner '{0}'; choose from {1}"
+            .format(aligner, sorted(INDEX_FILES)))
+    if aligner in LARGE_INDEX:
+        return INDEX_FILES[aligner](prefix, large=large)
+    if large:
+        raise ValueError("{0} has no large index variant".format(aligner))
+    return INDEX_FILES[aligner](prefix)
+
+
+def missing_index_files(prefix, aligner, large=False):
+    """
+    Return the index files for `prefix` that do not exist.
+
+    Parameters
+    ----------
+    prefix : str
+        Index prefix
+
+    aligner : str
+        One of the keys of INDEX_FILES, e.g., "hisat2"
+
+    large : bool
+        Check for the large-index variant. Only valid for aligners in
+        LARGE_INDEX.
+    """
+    return [
+        i for i in _index_files(prefix, aligner, large=large)
+        if not os.path.exists(i)
+    ]
+
+
+def _variants(aligner):
+    if aligner in LARGE_INDEX:
+        return [False, True]
+    return [False]
+
+
+def index_variant(prefix, aligner):
+    """
+    Identify which variant of the index exists for `prefix`.
+
+    Returns "small" if the complete small index exists, "large" if the
+    complete large index exists, or None if neither is complete. Aligners
+    without a large variant only ever report "small" or None.
+
+    If both are complete, the small index is reported since that is what the
+    aligners themselves use in that case.
+    """
+    for large in _variants(aligner):
+        if not missing_index_files(prefix, aligner, large=large):
+            return 'large' if large else 'small'
+    return None
+
+
+def existing_index_files(prefix, aligner):
+    """
+    Return the list of files making up the complete index for `prefix`,
+    whichever of the small or large variant that may be.
+
+    Raises ValueError if no variant is complete, listing the missing files
+    of the variant that is closest to complete.
+    """
+    variant = index_variant(prefix, aligner)
+    if variant is not None:
+        return _index_files(prefix, aligner, large=variant == 'large')
+    missing = min(
+        (
+            missing_index_files(prefix, aligner, large=large)
+            for large in _variants(aligner)
+        ),
+        key=len)
+    raise ValueError(
+        "Incomplete {0} index for prefix '{1}'; missing {2}"
+        .format(aligner, prefix, missing))
+
+
+def _md5(filename, blocksize=2 ** 20):
+    h = hashlib.md5()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IndexRegistry(object):
+    def __init__(self, filename):
+        """
+        Records content fingerprints of built indexes (and the files they
+        were built from) so that rebuilding can be skipped when nothing has
+        changed.
+
+        The md5 of each file is cached along with its size and modification
+        time, so unchanged files are only read once even across Snakemake
+        runs.
+
+        Several registries (e.g., one per rule, in concurrently running
+        rules) can share the same file: each one only writes the entries it
+        has changed, merged into the file under a lock.
+
+        For example, in the `run:` block of an index-building rule::
+
+            registry = IndexRegistry('references/index-registry.json')
+            if not registry.is_current(prefix, 'hisat2', source=input.fasta):
+                shell('hisat2-build {input.fasta} {prefix}')
+                registry.record(prefix, 'hisat2', source=input.fasta)
+
+        Parameters
+        ----------
+        filename : str
+            JSON file in which to store fingerprints. Created if needed.
+        """
+        self.filename = filename
+        self._files = {}
+        self._indexes = {}
+        # keys changed by this instance and not yet saved
+        self._new_files = set()
+        self._new_indexes = set()
+        self._refresh()
+
+    def _refresh(self):
+        """
+        Reload entries from disk, keeping any unsaved changes made here.
+        """
+        if os.path.exists(self.filename):
+            with open(self.filename) as fin:
+                d = json.load(fin)
+        else:
+            d = {}
+        files = d.get('files', {})
+        files.update((k, self._files[k]) for k in self._new_files)
+        indexes = d.get('indexes', {})
+        indexes.update((k, self._indexes[k]) for k in self._new_indexes)
+        self._files = files
+        self._indexes = indexes
+
+    @contextmanager
+    def _locked(self):
+        """
+        Exclusive lock on the registry file, where supported.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.filename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save(self):
+        """
+        Merge the entries changed here into the registry on disk.
+        """
+        if not (self._new_files or self._new_indexes):
+            return
+        with self._locked():
+            self._refresh()
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filename)),
+                prefix=os.path.basename(self.filename) + '.',
+                suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as fout:
+                    json.dump(
+                        dict(files=self._files, indexes=self._indexes), fout,
+                        indent=2, sort_keys=True)
+                os.replace(tmp, self.filename)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+        self._new_files.clear()
+        self._new_indexes.clear()
+
+    def file_fingerprint(self, filename):
+        """
+        md5 of the file's contents, only re-read if its size or modification
+        time has changed since last time.
+        """
+        st = os.stat(filename)
+        key = os.path.abspath(filename)
+        cached = self._files.get(key)
+        if (
+            cached is None or
+            cached['size'] != st.st_size or
+            cached['mtime'] != st.st_mtime_ns
+        ):
+            cached = dict(
+                size=st.st_size, mtime=st.st_mtime_ns, md5=_md5(filename))
+            self._files[key] = cached
+            self._new_files.add(key)
+        return cached['md5']
+
+    def fingerprint(self, prefix, aligner):
+        """
+        Fingerprint of the complete index for `prefix`.
+
+        Raises ValueError if the index is incomplete.
+        """
+        h = hashlib.md5()
+        for fn in existing_index_files(prefix, aligner):
+            h.update(os.path.basename(fn).encode())
+            h.update(self.file_fingerprint(fn).encode())
+        return h.hexdigest()
+
+    def _source_fingerprints(self, source):
+        if source is None:
+            return {}
+        if isinstance(source, str):
+            source = [source]
+        return {
+            os.path.abspath(i): self.file_fingerprint(i) for i in source}
+
+    def record(self, prefix, aligner, source=None):
+        """
+        Record the fingerprint of a freshly-built index and save the registry.
+
+        Parameters
+        ----------
+        prefix : str
+            Index prefix
+
+        aligner : str
+            One of the keys of INDEX_FILES, e.g., "hisat2"
+
+        source : str or list or None
+            File(s) the index was built from, e.g., the reference FASTA.
+        """
+        key = os.path.abspath(prefix)
+        self._indexes[key] = dict(
+            aligner=aligner,
+            variant=index_variant(prefix, aligner),
+            fingerprint=self.fingerprint(prefix, aligner),
+            source=self._source_fingerprints(source),
+        )
+        self._new_indexes.add(key)
+        self.save()
+
+    def is_current(self, prefix, aligner, source=None):
+        """
+        True if the index for `prefix` is complete, unchanged since it was
+        recorded, and was built from files identical to `source`.
+        """
+        self._refresh()
+        recorded = self._indexes.get(os.path.abspath(prefix))
+        if recorded is None or recorded['aligner'] != aligner:
+            return False
+        try:
+            fingerprint = self.fingerprint(prefix, aligner)
+            source = self._source_fingerprints(source)
+        except (ValueError, OSError):
+            return False
+        finally:
+            # keep any newly-computed file fingerprints (a no-op if there are
+            # none)
+            self.save()
+        return (
+            fingerprint == recorded['fingerprint'] and
+            source == recorded['source']
+        )
@@ -1,44 +1,213 @@
-import collections
+import json
+import os
 import re
+import subprocess
+import sys
+import uuid
+from collections.abc import Iterable, Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from itertools import product
+from textwrap import dedent
 import pandas as pd
 from snakemake.shell import shell
-from snakemake.io import expand, regex
+from snakemake.io import regex
 
 
-def fill_patterns(patterns, fill, combination=product):
+# Matches a single wildcard, optionally with a regex constraint, e.g.
+# ``{sample}`` or ``{sample,[^/]+}``.
+_wildcard_regex = re.compile(
+    r"""
+    \{
+        \s*(?P<name>\w+)
+        (\s*,\s*(?P<constraint>([^{}]+|\{\d+(,\d+)?\})*))?
+        \s*
+    \}
+    """, re.VERBOSE)
+
+# Like _wildcard_regex, but also matches escaped braces (``{{`` and ``}}``)
+# so that they are not mistaken for the start or end of a wildcard.
+_pattern_token_regex = re.compile(
+    r"(?P<escape>\{\{|\}\})|" + _wildcard_regex.pattern, re.VERBOSE)
+
+
+def _wildcard_matches(pattern):
+    """
+    Matches for the wildcards in `pattern`, skipping escaped braces.
+    """
+    return [
+        m for m in _pattern_token_regex.finditer(pattern)
+        if m.group('escape') is None]
+
+
+def _format_string(pattern, names):
+    """
+    Convert a Snakemake-style pattern into a positional format string.
+
+    Each wildcard is replaced with a field indexing into `names`, constraints
+    are stripped, and any other braces are escaped. Braces that are already
+    escaped by doubling them are kept as they are, so they come out of
+    `str.format` as single braces, as with Snakemake's `expand`.
+
+    >>> _format_string('{sample}/{sample,[^/]+}_R{N}.fastq', ['N', 'sample'])
+    '{1}/{1}_R{0}.fastq'
+    >>> _format_string('{{sample}}_R{N}.fastq', ['N'])
+    '{{sample}}_R{0}.fastq'
+    """
+    fmt = []
+    last = 0
+    for m in _pattern_token_regex.finditer(pattern):
+        fmt.append(
+            pattern[last:m.start()].replace('{', '{{').replace('}', '}}'))
+        if m.group('escape') is not None:
+            fmt.append(m.group('escape'))
+        else:
+            fmt.append('{%d}' % names.index(m.group('name')))
+        last = m.end()
+    fmt.append(pattern[last:].replace('{', '{{').replace('}', '}}'))
+    return ''.join(fmt)
+
+
+def _unique(items):
+    """
+    Remove duplicates while retaining the order of first appearance.
+    """
+    return list(dict.fromkeys(items))
+
+
+def _format_product_chunk(fmt, first, rest):
+    """
+    Fill `fmt` with the product of `first` and each list in `rest`. Module
+    level so that it can be sent to worker processes.
+    """
+    return _unique(fmt.format(*i) for i in product(first, *rest))
+
+
+def _fill_pattern(pattern, fill, combination=product, processes=None,
+                  chunksize=1000000):
+    """
+    Fill a single pattern. `fill` is a dict of lists.
+    """
+    names = [m.group('name') for m in _wildcard_matches(pattern)]
+    missing = sorted(set(names).difference(fill))
+    if missing:
+        raise KeyError(
+            "No values given for wildcard(s) {0} in pattern '{1}'"
+            .format(missing, pattern))
+
+    # Only the wildcards actually used in the pattern participate in the
+    # combination, in the order they appear in `fill`. For `product` the
+    # unused wildcards would only contribute duplicates; for `zip` the
+    # result is the same once duplicates are removed.
+    order = [k for k in fill if k in names]
+    values = [fill[k] for k in order]
+    fmt = _format_string(pattern, order)
+
+    if not values:
+        return [fmt]
+
+    if combination is product and processes and len(values[0]) > 1:
+        total = 1
+        for v in values:
+            total *= len(v)
+        if total >= chunksize:
+            # Split on the outermost wildcard so that each worker produces
+            # a contiguous, ordered block of the final result.
+            first = values[0]
+            step = max(1, (len(first) * chunksize) // total)
+            blocks = [first[i:i + step] for i in range(0, len(first), step)]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = executor.map(
+                    _format_product_chunk,
+                    [fmt] * len(blocks), blocks,
+                    [values[1:]] * len(blocks))
+                return _unique(i for block in results for i in block)
+
+    return _unique(fmt.format(*i) for i in combination(*values))
+
+
+def fill_patterns(patterns, fill, combination=product, processes=None):
     """
     Fills in a dictionary of patterns with the dictionary or DataFrame `fill`.
 
+    Filled-in patterns retain the order in which they were generated, with
+    duplicates removed.
+
     >>> patterns = dict(a='{sample}_R{N}.fastq')
     >>> fill = dict(sample=['one', 'two'], N=[1, 2])
-    >>> sorted(fill_patterns(patterns, fill)['a'])
+    >>> fill_patterns(patterns, fill)['a']
     ['one_R1.fastq', 'one_R2.fastq', 'two_R1.fastq', 'two_R2.fastq']
 
     >>> patterns = dict(a='{sample}_R{N}.fastq')
     >>> fill = dict(sample=['one', 'two'], N=[1, 2])
-    >>> sorted(fill_patterns(patterns, fill, zip)['a'])
+    >>> fill_patterns(patterns, fill, zip)['a']
     ['one_R1.fastq', 'two_R2.fastq']
 
     >>> patterns = dict(a='{sample}_R{N}.fastq')
     >>> fill = pd.DataFrame({'sample': ['one', 'two'], 'N': [1, 2]})
-    >>> sorted(fill_patterns(patterns, fill)['a'])
+    >>> fill_patterns(patterns, fill)['a']
     ['one_R1.fastq', 'two_R2.fastq']
 
+    Escaped braces are left for Snakemake to fill in later:
+
+    >>> fill_patterns(dict(a='{{sample}}_R{N}.fastq'), dict(N=[1, 2]))['a']
+    ['{sample}_R1.fastq', '{sample}_R2.fastq']
+
+    As with Snakemake's `expand`, only the values of wildcards used in
+    a pattern are combined for it, and keys of `fill` that a pattern does not
+    use are ignored. With `zip`, this means that the number of results for
+    each pattern is limited by the shortest list among its own wildcards
+    only.
+
+    Parameters
+    ----------
+    patterns : dict
+        Arbitrarily nested dictionary whose leaves are Snakemake-style
+        patterns.
+
+    fill : dict or pandas.DataFrame
+        Values for the wildcards. If a DataFrame, each row is used as one set
+        of values (that is, `combination` is always `zip`).
+
+    combination : callable
+        How to combine the values in `fill`; typically `product` or `zip`.
+
+    processes : int or None
+        If not None, large `product` expansions are split across this many
+        worker processes.
     """
-    def update(d, u, c):
+    # Convert once rather than for every leaf
+    if isinstance(fill, pd.DataFrame):
+        fill = fill.to_dict('list')
+        combination = zip
+    else:
+        fill = {
+            k: [v] if isinstance(v, str) or not isinstance(v, Iterable)
+            else list(v)
+            for k, v in fill.items()
+        }
+
+    def update(d, u):
         for k, v in u.items():
-            if isinstance(v, collections.Mapping):
-                r = update(d.get(k, {}), v, c)
-                d[k] = r
+            if isinstance(v, Mapping):
+                d[k] = update(d.get(k, {}), v)
+            elif isinstance(v, str):
+                d[k] = _fill_pattern(v, fill, combination, processes)
             else:
-                if isinstance(fill, pd.DataFrame):
-                    d[k] = list(set(expand(u[k], zip, **fill.to_dict('list'))))
-                else:
-                    d[k] = list(set(expand(u[k], c, **fill)))
+                d[k] = _unique(
+                    i for pattern in v
+                    for i in _fill_pattern(
+                        pattern, fill, combination, processes))
         return d
-    d = {}
-    return update(d, patterns, combination)
+    return update({}, patterns)
+
+
+@lru_cache(maxsize=256)
+def _compiled_regex(pattern):
+    """
+    Compiled regex for a Snakemake-style pattern, cached across calls.
+    """
+    return re.compile(regex(pattern))
 
 
 def extract_wildcards(pattern, target):
@@ -63,12 +232,341 @@ def extract_wildcards(pattern, target):
     >>> assert extract_wildcards(pattern, target) == expected
     >>> assert extract_wildcards(pattern, 'asdf') is None
     """
-    m = re.compile(regex(pattern)).match(target)
+    m = _compiled_regex(pattern).match(target)
     if m:
         return m.groupdict()
 
 
-def rscript(string, scriptname, log=None):
+def extract_wildcards_many(pattern, targets, vectorized=False, dropna=False):
+    """
+    Extract wildcards from many targets at once using a single compiled regex.
+
+    Parameters
+    ----------
+    pattern : str
+        Snakemake-style filename pattern, e.g. ``{output}/{sample}.bam``.
+
+    targets : iterable of str
+        Filenames from which to extract wildcards.
+
+    vectorized : bool
+        If True, use pandas.Series.str.extract to do the matching rather than
+        matching each target in turn.
+
+    dropna : bool
+        If True, drop targets that did not match the pattern. Otherwise they
+        are retained, with NaN for all wildcards.
+
+    Returns
+    -------
+    pandas.DataFrame indexed by target, with one column per wildcard.
+
+    Examples
+    --------
+    >>> df = extract_wildcards_many(
+    ...     '{output}/{sample}.bam', ['data/a.bam', 'data/b.bam', 'asdf'])
+    >>> df.loc['data/b.bam', 'sample']
+    'b'
+    >>> df.loc['asdf'].isnull().all()
+    True
+    """
+    compiled = _compiled_regex(pattern)
+    names = list(compiled.groupindex)
+    targets = pd.Index(targets)
+    if vectorized:
+        # str.extract searches rather than matches, so anchor at the start.
+        df = targets.to_series().str.extract(
+            re.compile(r'\A(?:' + compiled.pattern + ')'), expand=True)
+        df = df[names]
+    else:
+        match = compiled.match
+        rows = [
+            m.groupdict() if m else {}
+            for m in (match(target) for target in targets)
+        ]
+        df = pd.DataFrame(rows, index=targets, columns=names)
+    if dropna:
+        df = df.dropna(how='all')
+    return df
+
+
+def _scan_components(pattern):
+    """
+    Split a pattern into path components. Components without wildcards are
+    kept as strings; the rest are converted to compiled regexes.
+    """
+    # Split on "/", ignoring any that are within wildcard constraints
+    spans = [m.span() for m in _wildcard_regex.finditer(pattern)]
+    splits = [
+        i for i, c in enumerate(pattern)
+        if c == '/' and not any(start < i < end for start, end in spans)
+    ]
+    bounds = zip([-1] + splits, splits + [len(pattern)])
+
+    components = []
+    for start, end in bounds:
+        component = pattern[start + 1:end]
+        if _wildcard_regex.search(component):
+            components.append(_compiled_regex(component))
+        else:
+            components.append(component)
+    return components
+
+
+def _scan(path, components, bound):
+    """
+    Recursively find paths below `path` matching `components`, yielding
+    (path, wildcards) tuples.
+    """
+    component = components[0]
+    last = len(components) == 1
+
+    if isinstance(component, str):
+        child = path + component
+        if last:
+            if os.path.lexists(child):
+                yield child, bound
+        elif os.path.isdir(child):
+            yield from _scan(child + '/', components[1:], bound)
+        return
+
+    try:
+        entries = os.scandir(path or '.')
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+
+    with entries:
+        for entry in entries:
+            m = component.match(entry.name)
+            if not m:
+                continue
+            wildcards = m.groupdict()
+
+            # The same wildcard may appear in more than one component, e.g.
+            # {sample}/{sample}.bam, so values must agree with those already
+            # seen further up the tree.
+            if any(bound.get(k, v) != v for k, v in wildcards.items()):
+                continue
+            wildcards = dict(bound, **wildcards)
+
+            if last:
+                yield path + entry.name, wildcards
+            elif entry.is_dir():
+                yield from _scan(
+                    path + entry.name + '/', components[1:], wildcards)
+
+
+def scan_wildcards(pattern, threads=None):
+    """
+    Find all existing files matching a Snakemake-style pattern.
+
+    Unlike walking the entire directory tree and calling
+    `extract_wildcards` on every path, each directory level of the pattern
+    is matched as the tree is walked, so only directories that can possibly
+    contain a match are visited. Directory components without wildcards are
+    not listed at all.
+
+    Wildcards are assumed not to span directories; that is, each wildcard
+    matches within a single path component.
+
+    Parameters
+    ----------
+    pattern : str
+        Snakemake-style pattern, e.g. ``samples/{sample}/{sample}.bam``.
+
+    threads : int or None
+        If not None, the subdirectories matching the first wildcard component
+        are scanned in parallel using this many threads.
+
+    Returns
+    -------
+    pandas.DataFrame indexed by path, sorted, with one column per wildcard.
+    """
+    names = list(_compiled_regex(pattern).groupindex)
+    components = _scan_components(pattern)
+    path = ''
+    if components[0] == '':
+        # absolute path
+        path = '/'
+        components = components[1:]
+
+    # Descend through the fixed prefix directly
+    while len(components) > 1 and isinstance(components[0], str):
+        path += components.pop(0) + '/'
+
+    if threads and len(components) > 1:
+        if not os.path.isdir(path or '.'):
+            results = []
+        else:
+            first = [
+                (p + '/', w)
+                for p, w in _scan(path, components[:1], {})
+                if os.path.isdir(p)
+            ]
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = executor.map(
+                    lambda x: list(_scan(x[0], components[1:], x[1])), first)
+                results = [i for block in results for i in block]
+    else:
+        results = list(_scan(path, components, {}))
+
+    results.sort(key=lambda x: x[0])
+    return pd.DataFrame(
+        [w for _, w in results],
+        index=pd.Index([p for p, _ in results]),
+        columns=names)
+
+
+class RSession(object):
+    """
+    A long-lived R process that runs scripts one after another.
+
+    Starting R and loading libraries like DESeq2 can take longer than the
+    analysis itself. An RSession starts R once and then sources each script
+    in a fresh environment within that process, so libraries stay loaded
+    between scripts while variables do not leak from one script to the next.
+
+    Use as a context manager to ensure the R process is shut down::
+
+        with RSession(preload=['DESeq2']) as session:
+            for contrast, script in scripts.items():
+                rscript(script, contrast + '.R', log=contrast + '.log',
+                        session=session)
+
+    Parameters
+    ----------
+    executable : str
+        R executable to run.
+
+    preload : list
+        Libraries to load when the session starts.
+    """
+    def __init__(self, executable='R', preload=None):
+        self.executable = executable
+        self.proc = subprocess.Popen(
+            [executable, '--slave', '--no-restore', '--no-save'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True, bufsize=1)
+        for lib in preload or []:
+            self._execute(
+                'suppressPackageStartupMessages(library({0}))'.format(lib),
+                'library({0})'.format(lib))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the R process.
+        """
+        if self.proc.poll() is None:
+            self.proc.stdin.write('quit(save="no")\n')
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc.stdout.close()
+
+    def _execute(self, expr, description, log=None):
+        """
+        Evaluate `expr` in the R process, optionally redirecting stdout and
+        stderr to `log`, and wait for it to complete. Raises
+        CalledProcessError if there was an error in R.
+        """
+        if self.proc.poll() is not None:
+            raise ValueError("R session is closed")
+
+        # Unique marker so we know when R has finished with this expression.
+        token = '__lcdblib_done_{0}__'.format(uuid.uuid4().hex)
+
+        code = dedent("""
+            local({{
+                .log <- {log}
+                if (!is.null(.log)) {{
+                    .con <- file(.log, open = "wt")
+                    sink(.con)
+                    sink(.con, type = "message")
+                }}
+                .status <- tryCatch({{
+                    {expr}
+                    0L
+                }}, error = function(e) {{
+                    message("Error: ", conditionMessage(e))
+                    1L
+                }})
+                if (!is.null(.log)) {{
+                    sink(type = "message")
+                    sink()
+                    close(.con)
+                }}
+                cat("{token} ", .status, "\\n", sep = "")
+                flush(stdout())
+            }})
+            """).format(
+                log=_r_string(log) if log else 'NULL',
+                expr=expr,
+                token=token)
+        self.proc.stdin.write(code)
+        self.proc.stdin.flush()
+
+        for line in self.proc.stdout:
+            # The script's own output may not have ended with a newline
+            i = line.find(token)
+            if i >= 0:
+                sys.stdout.write(line[:i])
+                status = int(line[i:].split()[1])
+                break
+            sys.stdout.write(line)
+        else:
+            # R exited before finishing
+            raise subprocess.CalledProcessError(
+                self.proc.wait() or 1, description)
+        if status:
+            raise subprocess.CalledProcessError(status, description)
+
+    def run(self, scriptname, log=None):
+        """
+        Source `scriptname` in a new environment.
+
+        Parameters
+        ----------
+        scriptname : str
+            R script to run
+
+        log : str
+            File to redirect stdout and stderr to. If None, no redirection
+            occurs.
+        """
+        self._execute(
+            'source({0}, local = new.env(parent = globalenv()))'
+            .format(_r_string(scriptname)),
+            'source({0})'.format(scriptname),
+            log=log)
+
+    def run_many(self, scripts):
+        """
+        Run several scripts in this session, in order.
+
+        Parameters
+        ----------
+        scripts : list
+            List of (scriptname, log) tuples, each of which is passed to
+            `run()`.
+        """
+        for scriptname, log in scripts:
+            self.run(scriptname, log=log)
+
+
+def _r_string(s):
+    """
+    Quote a string for use in R code. JSON string escapes are also valid in
+    R.
+    """
+    return json.dumps(s)
+
+
+def rscript(string, scriptname, log=None, session=None):
     """
     Saves the string as `scriptname` and then runs it
 
@@ -82,9 +580,16 @@ def rscript(string, scriptname, log=None):
 
     log : str
         File to redirect stdout and stderr to. If None, no redirection occurs.
+
+    session : RSession or None
+        If not None, run the script in this already-running R session rather
+        than starting a new Rscript process.
     """
     with open(scriptname, 'w') as fout:
         fout.write(string)
+    if session is not None:
+        session.run(scriptname, log=log)
+        return
     if log:
         _log = '> {0} 2>&1'.format(log)
     else:
@@ -0,0 +1,203 @@
+"""
+Module for testing gene lists against many gene sets (GO terms, pathways,
+etc) at once.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from lcdblib.stats import fisher
+
+
+class GeneSets(object):
+    def __init__(self, sets):
+        """
+        A collection of gene sets, stored as a sparse gene x set membership
+        matrix so that overlaps with any number of gene lists can be computed
+        with a single sparse matrix-vector product.
+
+        Parameters
+        ----------
+        sets : dict
+            Maps set name to an iterable of gene IDs. Duplicate IDs within
+            a set are counted once.
+        """
+        names = list(sets)
+        members = [pd.unique(np.asarray(list(sets[i]), dtype=object))
+                   for i in names]
+        self.names = pd.Index(names)
+        if members:
+            self.genes = pd.Index(
+                pd.unique(np.concatenate(members))).sort_values()
+        else:
+            self.genes = pd.Index([], dtype=object)
+        rows = self.genes.get_indexer(
+            np.concatenate(members) if members else [])
+        cols = np.repeat(
+            np.arange(len(names)), [len(i) for i in members])
+        # CSC, so that the transpose used in `enrich` is CSR without a copy
+        self.matrix = sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, cols)),
+            shape=(len(self.genes), len(names)))
+
+    @classmethod
+    def from_gmt(cls, filename):
+        """
+        Create a GeneSets object from a GMT file, where each line is a set
+        name, a description, and then tab-separated gene IDs.
+        """
+        sets = {}
+        with open(filename) as fin:
+            for line in fin:
+                toks = line.rstrip('\n\r').split('\t')
+                if len(toks) < 2:
+                    continue
+                sets[toks[0]] = [i for i in toks[2:] if i]
+        return cls(sets)
+
+    @classmethod
+    def from_dataframe(cls, df, gene_column, set_column):
+        """
+        Create a GeneSets object from a long-format DataFrame with one row per
+        (gene, set) pair.
+        """
+        return cls(
+            df.groupby(set_column, sort=False)[gene_column].agg(list).to_dict())
+
+    def __len__(self):
+        return len(self.names)
+
+    def _indicator(self, genes):
+        """
+        0/1 vector over self.genes for the genes in `genes`, which can be an
+        iterable of gene IDs or a boolean Series indexed by gene ID. Genes
+        not in any set are ignored.
+        """
+        if isinstance(genes, pd.Series) and genes.dtype == bool:
+            genes = genes.index[genes.values]
+        idx = self.genes.get_indexer(pd.unique(np.asarray(list(genes),
+                                                          dtype=object)))
+        v = np.zeros(len(self.genes), dtype=np.int64)
+        v[idx[idx >= 0]] = 1
+        return v
+
+    def enrich(self, selected, background=None, alternative='greater',
+               min_size=1, max_size=None):
+        """
+        Test a gene list for enrichment in every set.
+
+        Parameters
+        ----------
+        selected : iterable or boolean pandas.Series
+            Selected gene IDs (e.g., differentially expressed genes), or
+            a boolean Series indexed by gene ID.
+
+        background : iterable or boolean pandas.Series
+            Gene universe (e.g., all genes tested for differential
+            expression). `selected` is restricted to it. By default, the
+            union of all genes in all sets is used.
+
+        alternative : str
+            Passed to `fisher.fisher_many`. The default, "greater", tests for
+            over-representation.
+
+        min_size, max_size : int
+            Only sets with this many genes in the background are tested (and
+            counted for the multiple testing correction).
+
+        Returns
+        -------
+        DataFrame indexed by set name and sorted by p-value, with columns
+        "size" (set genes in the background), "overlap" (selected set genes),
+        "expected", "oddsratio", "pval", "padj", and the four cells of each
+        set's 2x2 table ("t11", "t12", "t21", "t22"; rows are in set/not,
+        columns are selected/not).
+        """
+        if background is None:
+            bg = np.ones(len(self.genes), dtype=np.int64)
+            sel = self._indicator(selected)
+            n_background = len(self.genes)
+            n_selected = int(sel.sum())
+        else:
+            if isinstance(background, pd.Series) and background.dtype == bool:
+                background = background.index[background.values]
+            background = pd.Index(pd.unique(
+                np.asarray(list(background), dtype=object)))
+            if isinstance(selected, pd.Series) and selected.dtype == bool:
+                selected = selected.index[selected.values]
+            selected = background.intersection(
+                pd.Index(pd.unique(np.asarray(list(selected), dtype=object))))
+            bg = self._indicator(background)
+            sel = self._indicator(selected)
+            n_background = len(background)
+            n_selected = len(selected)
+
+        mt = self.matrix.T
+        size = mt @ bg
+        overlap = mt @ sel
+
+        keep = size >= min_size
+        if max_size is not None:
+            keep &= size <= max_size
+        size = size[keep]
+        overlap = overlap[keep]
+
+        tables = np.column_stack([
+            overlap,
+            size - overlap,
+            n_selected - overlap,
+            n_background - size - n_selected + overlap,
+        ])
+        oddsratio, pval, padj = fisher.fisher_many(
+            tables, alternative=alternative, fdr=True)
+        results = pd.DataFrame(
+            dict(
+                size=size,
+                overlap=overlap,
+                expected=size * n_selected / max(n_background, 1),
+                oddsratio=oddsratio,
+                pval=pval,
+                padj=padj,
+                t11=tables[:, 0],
+                t12=tables[:, 1],
+                t21=tables[:, 2],
+                t22=tables[:, 3],
+            ),
+            index=self.names[keep],
+        )
+        return results.sort_values('pval', kind='mergesort')
+
+
+def enrichment_report(results, top=10, alpha=None,
+                      row_names=['in set', 'not in set'],
+                      col_names=['selected', 'not selected']):
+    """
+    `fisher.fisher_tables` reports for the top hits of `GeneSets.enrich`.
+
+    Parameters
+    ----------
+    results : pandas.DataFrame
+        Output of `GeneSets.enrich`
+
+    top : int
+        Report at most this many sets, in order of p-value
+
+    alpha : float or None
+        If not None, only report sets with padj below this value
+
+    row_names, col_names : list
+        Passed to `fisher.fisher_tables`
+    """
+    results = results.sort_values('pval', kind='mergesort')
+    if alpha is not None:
+        results = results[results['padj'] < alpha]
+    s = []
+    for name, row in results.head(top).iterrows():
+        table = [int(row[i]) for i in ['t11', 't12', 't21', 't22']]
+        s.append(fisher.fisher_tables(
+            table, row_names=row_names, col_names=col_names,
+            title=str(name)))
+        s.append('padj: {:g}'.format(row['padj']))
+        s.append('')
+    return '\n'.join(s)
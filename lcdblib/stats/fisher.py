@@ -2,6 +2,11 @@
 Module for easily running and reporting Fishers exact tests.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
 from scipy.stats import fisher_exact
 
 
@@ -174,6 +179,133 @@ def fisher(table):
     )
 
 
+def _log_factorials(n):
+    """
+    log(k!) for k in 0..n
+    """
+    return gammaln(np.arange(n + 1) + 1)
+
+
+def bh_fdr(pvals):
+    """
+    Benjamini-Hochberg adjusted p-values.
+
+    Parameters
+    ----------
+    pvals : array-like
+        Raw p-values. NaNs are ignored and remain NaN.
+    """
+    pvals = np.asarray(pvals, dtype=float)
+    adjusted = np.full(pvals.shape, np.nan)
+    ok = ~np.isnan(pvals)
+    p = pvals[ok]
+    n = len(p)
+    if n == 0:
+        return adjusted
+    order = np.argsort(p)[::-1]
+    ranked = p[order] * n / np.arange(n, 0, -1)
+    ranked = np.minimum(1, np.minimum.accumulate(ranked))
+    result = np.empty(n)
+    result[order] = ranked
+    adjusted[ok] = result
+    return adjusted
+
+
+def fisher_many(tables, alternative='two-sided', fdr=False):
+    """
+    Perform Fisher's exact test on many 2x2 tables at once.
+
+    Tables are grouped by their margins. The hypergeometric distribution for
+    each distinct set of margins is computed once from a shared table of log
+    factorials, and p-values for every table with those margins are looked
+    up from it. Results match scipy.stats.fisher_exact.
+
+    Parameters
+    ----------
+    tables : array-like, shape (N, 4)
+        Each row holds the four cells of a 2x2 table: [r1c1, r1c2, r2c1,
+        r2c2]
+
+    alternative : str
+        One of "two-sided", "less", or "greater", as in
+        scipy.stats.fisher_exact.
+
+    fdr : bool
+        If True, also return Benjamini-Hochberg adjusted p-values.
+
+    Returns
+    -------
+    Tuple of (odds ratios, pvalues) arrays, or (odds ratios, pvalues,
+    adjusted pvalues) if `fdr` is True.
+    """
+    if alternative not in ('two-sided', 'less', 'greater'):
+        raise ValueError(
+            "`alternative` must be one of 'two-sided', 'less', 'greater'")
+    tables = np.asarray(tables, dtype=np.int64).reshape(-1, 4)
+    if (tables < 0).any():
+        raise ValueError("All values in tables must be nonnegative")
+    t11, t12, t21, t22 = tables.T
+    r1 = t11 + t12
+    c1 = t11 + t21
+    n = tables.sum(axis=1)
+
+    # Odds ratios, following scipy.stats.fisher_exact's conventions
+    with np.errstate(divide='ignore', invalid='ignore'):
+        oddsratio = np.where(
+            (t12 > 0) & (t21 > 0),
+            (t11 * t22) / (t12 * t21).astype(float),
+            np.inf)
+    empty_margin = (r1 == 0) | (c1 == 0) | (r1 == n) | (c1 == n)
+    oddsratio[empty_margin] = np.nan
+
+    pvals = np.ones(len(tables))
+    if len(tables) == 0:
+        return (oddsratio, pvals, pvals.copy()) if fdr else (oddsratio, pvals)
+
+    lf = _log_factorials(n.max())
+    margins, inverse = np.unique(
+        np.column_stack([r1, c1, n]), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(margins) + 1))
+
+    # Python ints make the per-group arithmetic much cheaper than numpy
+    # scalars.
+    for (_r1, _c1, _n), start, stop in zip(
+            margins.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+        lo = max(0, _r1 + _c1 - _n)
+        hi = min(_r1, _c1)
+        if lo == hi:
+            # Only one possible table
+            continue
+        idx = order[start:stop]
+        x = np.arange(lo, hi + 1)
+        const = (
+            lf[_c1] + lf[_n - _c1] - lf[_n] + lf[_r1] + lf[_n - _r1])
+        pmf = np.exp(
+            const - lf[x] - lf[_c1 - x] - lf[_r1 - x] -
+            lf[_n - _c1 - _r1 + x]
+        )
+        k = t11[idx] - lo
+        if alternative == 'less':
+            p = np.cumsum(pmf)[k]
+        elif alternative == 'greater':
+            p = np.cumsum(pmf[::-1])[::-1][k]
+        else:
+            # Sum of probabilities of all tables no more likely than the
+            # observed one, with the same relative tolerance as scipy.
+            ranked = np.sort(pmf)
+            cumulative = np.cumsum(ranked)
+            j = np.searchsorted(ranked, pmf[k] * (1 + 1e-7), side='right')
+            p = cumulative[j - 1]
+        pvals[idx] = p
+
+    pvals = np.minimum(pvals, 1)
+    if fdr:
+        return oddsratio, pvals, bh_fdr(pvals)
+    return oddsratio, pvals
+
+
 def table_from_bool(ind1, ind2):
     """
     Given two boolean arrays, return the 2x2 contingency table
@@ -181,14 +313,198 @@ def table_from_bool(ind1, ind2):
     ind1, ind2 : array-like
         Arrays of the same length
     """
+    ind1 = np.asarray(ind1, dtype=bool)
+    ind2 = np.asarray(ind2, dtype=bool)
+    n = len(ind1)
+    n1 = int(np.count_nonzero(ind1))
+    n2 = int(np.count_nonzero(ind2))
+    both = int(np.count_nonzero(ind1 & ind2))
     return [
-            sum(ind1 & ind2),
-            sum(ind1 & ~ind2),
-            sum(~ind1 & ind2),
-            sum(~ind1 & ~ind2),
+            both,
+            n1 - both,
+            n2 - both,
+            n - n1 - n2 + both,
         ]
 
 
+def table_from_bool_matrix(ind, others):
+    """
+    Given a boolean array and a 2D boolean array (or DataFrame) with one
+    column per comparison, return the 2x2 contingency table of `ind` against
+    each column.
+
+    Parameters
+    ----------
+    ind : array-like
+        Boolean array of length N
+
+    others : 2D array-like or pandas.DataFrame
+        Boolean array of shape (N, K)
+
+    Returns
+    -------
+    Array of shape (K, 4), one table per column of `others` in the same
+    layout as `table_from_bool`, suitable for `fisher_many`. If `others` is
+    a DataFrame, a DataFrame indexed by its columns is returned instead.
+    """
+    columns = getattr(others, 'columns', None)
+    ind = np.asarray(ind, dtype=bool)
+    others = np.asarray(others, dtype=bool)
+    n = len(ind)
+    n1 = np.count_nonzero(ind)
+    n2 = np.count_nonzero(others, axis=0)
+    both = np.count_nonzero(others[ind], axis=0)
+    tables = np.column_stack([both, n1 - both, n2 - both, n - n1 - n2 + both])
+    if columns is not None:
+        return pd.DataFrame(
+            tables, index=columns, columns=['t11', 't12', 't21', 't22'])
+    return tables
+
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT = np.array([bin(i).count('1') for i in range(256)],
+                         dtype=np.uint8)
+
+    def _popcount(x):
+        return _POPCOUNT[x]
+
+
+def _permutation_block(packed1, ind2, bounds, seed, size):
+    """
+    Overlap counts of `packed1` with `size` shuffles of `ind2`, where each
+    shuffle permutes `ind2` only within the slices delimited by `bounds`.
+    Module-level so that it can be sent to worker processes.
+    """
+    rng = np.random.default_rng(seed)
+    shuffled = np.empty((size, len(ind2)), dtype=bool)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        block = shuffled[:, start:stop]
+        block[:] = ind2[start:stop]
+        rng.permuted(block, axis=1, out=block)
+    packed = np.packbits(shuffled, axis=1)
+    return _popcount(packed & packed1).sum(axis=1, dtype=np.int64)
+
+
+def permutation_test(ind1, ind2, n_permutations=10000, strata=None,
+                     bins=None, alternative='two-sided', seed=None,
+                     processes=None, blocksize=1000, return_null=False):
+    """
+    Label-shuffling permutation test for the 2x2 table of two boolean
+    arrays, as an alternative to `fisher` when the items have a bias (e.g.,
+    length or GC content) that the hypergeometric null ignores.
+
+    `ind2` is shuffled, optionally only within strata, while `ind1` is held
+    fixed. Shuffles are generated in blocks as packed bit arrays and the
+    overlaps are counted with a popcount. Margins are fixed under shuffling,
+    so the overlap determines the whole table.
+
+    Parameters
+    ----------
+    ind1, ind2 : array-like
+        Boolean arrays of the same length
+
+    n_permutations : int
+        Number of shuffles
+
+    strata : array-like or None
+        Labels of the same length as `ind1`. Values of `ind2` are only
+        shuffled among items with the same label. Missing labels (or, with
+        `bins`, missing covariate values) raise a ValueError; drop those
+        items first.
+
+    bins : int or None
+        If not None, `strata` is a continuous covariate which is first cut
+        into this many quantile bins.
+
+    alternative : str
+        One of "two-sided", "less", or "greater", as in `fisher_many`.
+        Two-sided p-values count shuffles whose overlap is at least as far
+        from the expected overlap as the observed one.
+
+    seed : int or None
+        Seed for numpy.random.SeedSequence. Each block of `blocksize`
+        shuffles gets its own spawned seed, so results depend only on
+        `seed` and `blocksize` and not on `processes`.
+
+    processes : int or None
+        If not None, use this many worker processes.
+
+    blocksize : int
+        Number of shuffles generated at a time
+
+    return_null : bool
+        If True, also return the overlap of every shuffle.
+
+    Returns
+    -------
+    Tuple of (odds ratio, empirical pvalue), plus the array of null
+    overlaps if `return_null` is True. The p-value is computed as
+    (1 + number of shuffles as extreme as observed) / (1 + n_permutations).
+    """
+    if alternative not in ('two-sided', 'less', 'greater'):
+        raise ValueError(
+            "`alternative` must be one of 'two-sided', 'less', 'greater'")
+    ind1 = np.asarray(ind1, dtype=bool)
+    ind2 = np.asarray(ind2, dtype=bool)
+    if ind1.shape != ind2.shape:
+        raise ValueError("ind1 and ind2 must have the same length")
+    table = table_from_bool(ind1, ind2)
+    oddsratio = fisher_many([table])[0][0]
+
+    if strata is None:
+        codes = np.zeros(len(ind1), dtype=np.int64)
+    else:
+        if bins is not None:
+            strata = pd.qcut(strata, bins, labels=False, duplicates='drop')
+        codes = pd.factorize(np.asarray(strata))[0]
+        if len(codes) != len(ind1):
+            raise ValueError("strata must have the same length as ind1")
+        if (codes < 0).any():
+            raise ValueError(
+                "strata has %d missing values" % np.count_nonzero(codes < 0))
+
+    # Group items by stratum so that each stratum is a contiguous slice
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+    bounds = [0] + bounds.tolist() + [len(codes)]
+    packed1 = np.packbits(ind1[order])
+    ind2 = ind2[order]
+
+    sizes = [blocksize] * (n_permutations // blocksize)
+    if n_permutations % blocksize:
+        sizes.append(n_permutations % blocksize)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([packed1] * len(sizes), [ind2] * len(sizes),
+            [bounds] * len(sizes), seeds, sizes)
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            null = list(executor.map(_permutation_block, *args))
+    else:
+        null = list(map(_permutation_block, *args))
+    null = np.concatenate(null) if null else np.zeros(0, dtype=np.int64)
+
+    observed = table[0]
+    if alternative == 'greater':
+        extreme = null >= observed
+    elif alternative == 'less':
+        extreme = null <= observed
+    else:
+        # Expected overlap under stratified shuffling
+        n = np.bincount(sorted_codes)
+        n1 = np.bincount(sorted_codes, weights=ind1[order])
+        n2 = np.bincount(sorted_codes, weights=ind2)
+        expected = (n1 * n2 / n).sum()
+        extreme = (
+            np.abs(null - expected) >= abs(observed - expected) * (1 - 1e-7))
+    pval = (1 + np.count_nonzero(extreme)) / (1 + len(null))
+    if return_null:
+        return oddsratio, pval, null
+    return oddsratio, pval
+
+
 def fisher_tables(table, row_names=['class 1', 'not'],
                   col_names=['class 2', 'not'], title=None):
     """
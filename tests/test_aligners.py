@@ -1,3 +1,4 @@
+import os
 import pytest
 from lcdblib.snakemake import aligners
 
@@ -36,3 +37,138 @@ def test_bowtie2_prefixes():
 
     with pytest.raises(ValueError):
         aligners.prefix_from_bowtie2_index(['a/b.1.bt2', 'z/b.2.bt2'])
+
+
+def test_large_index_files():
+    assert aligners.hisat2_index_from_prefix('a/b/c', large=True)[0] == 'a/b/c.1.ht2l'
+    assert aligners.bowtie2_index_from_prefix('a/b/c', large=True)[-1] == 'a/b/c.rev.2.bt2l'
+    assert aligners.prefix_from_hisat2_index(
+        aligners.hisat2_index_from_prefix('a/b/c', large=True)) == 'a/b/c'
+    assert aligners.prefix_from_bowtie2_index(
+        aligners.bowtie2_index_from_prefix('a/b/c', large=True)) == 'a/b/c'
+
+
+def _touch(files, content='x'):
+    for fn in files:
+        with open(fn, 'w') as fout:
+            fout.write(content)
+
+
+def test_index_variant(tmpdir):
+    prefix = str(tmpdir.join('genome'))
+    assert aligners.index_variant(prefix, 'bowtie2') is None
+
+    large = aligners.bowtie2_index_from_prefix(prefix, large=True)
+    _touch(large[:-1])
+    assert aligners.index_variant(prefix, 'bowtie2') is None
+    assert aligners.missing_index_files(prefix, 'bowtie2', large=True) == large[-1:]
+    with pytest.raises(ValueError):
+        aligners.existing_index_files(prefix, 'bowtie2')
+
+    _touch(large[-1:])
+    assert aligners.index_variant(prefix, 'bowtie2') == 'large'
+    assert aligners.existing_index_files(prefix, 'bowtie2') == large
+
+    with pytest.raises(ValueError):
+        aligners.index_variant(prefix, 'unknown')
+
+
+def test_index_registry(tmpdir):
+    prefix = str(tmpdir.join('genome'))
+    fasta = str(tmpdir.join('genome.fa'))
+    registry_fn = str(tmpdir.join('registry.json'))
+    files = aligners.hisat2_index_from_prefix(prefix)
+    _touch(files)
+    _touch([fasta], '>chr1\nACGT\n')
+
+    registry = aligners.IndexRegistry(registry_fn)
+    assert not registry.is_current(prefix, 'hisat2', source=fasta)
+    registry.record(prefix, 'hisat2', source=fasta)
+    assert registry.is_current(prefix, 'hisat2', source=fasta)
+
+    # reloaded from disk
+    registry = aligners.IndexRegistry(registry_fn)
+    assert registry.is_current(prefix, 'hisat2', source=fasta)
+    assert not registry.is_current(prefix, 'bowtie2', source=fasta)
+
+    # changed source
+    _touch([fasta], '>chr1\nACGTT\n')
+    assert not registry.is_current(prefix, 'hisat2', source=fasta)
+    _touch([fasta], '>chr1\nACGT\n')
+    assert registry.is_current(prefix, 'hisat2', source=fasta)
+
+    # changed index contents
+    _touch(files[:1], 'y')
+    assert not registry.is_current(prefix, 'hisat2', source=fasta)
+
+    # incomplete index
+    registry.record(prefix, 'hisat2', source=fasta)
+    os.unlink(files[-1])
+    assert not registry.is_current(prefix, 'hisat2', source=fasta)
+
+
+def test_index_registry_shared(tmpdir):
+    registry_fn = str(tmpdir.join('registry.json'))
+    prefixes = {}
+    for aligner in ['hisat2', 'bowtie2']:
+        prefixes[aligner] = str(tmpdir.join(aligner))
+        _touch(getattr(aligners, aligner + '_index_from_prefix')(
+            prefixes[aligner]))
+
+    # e.g., one registry per rule, both created before either index is built
+    r1 = aligners.IndexRegistry(registry_fn)
+    r2 = aligners.IndexRegistry(registry_fn)
+    r1.record(prefixes['hisat2'], 'hisat2')
+    r2.record(prefixes['bowtie2'], 'bowtie2')
+    assert not r2.is_current(prefixes['hisat2'], 'bowtie2')
+
+    for registry in [r1, r2, aligners.IndexRegistry(registry_fn)]:
+        assert registry.is_current(prefixes['hisat2'], 'hisat2')
+        assert registry.is_current(prefixes['bowtie2'], 'bowtie2')
+    assert not [i for i in os.listdir(str(tmpdir)) if i.endswith('.tmp')]
+
+
+@pytest.mark.parametrize('aligner,prefix,first', [
+    ('bwa', 'a/b/c', 'a/b/c.amb'),
+    ('kallisto', 'a/b/c', 'a/b/c.idx'),
+    ('star', 'a/b/star', 'a/b/star/Genome'),
+    ('salmon', 'a/b/salmon', 'a/b/salmon/ctable.bin'),
+])
+def test_other_prefixes(aligner, prefix, first):
+    to_files = getattr(aligners, '{0}_index_from_prefix'.format(aligner))
+    to_prefix = getattr(aligners, 'prefix_from_{0}_index'.format(aligner))
+    files = to_files(prefix)
+    assert files[0] == first
+    assert to_prefix(files) == prefix
+    assert to_prefix(files[-1]) == prefix
+    with pytest.raises(ValueError):
+        to_prefix([files[0], 'z/' + files[-1]])
+
+
+def test_prefixes_from_index():
+    lists = [
+        aligners.bowtie2_index_from_prefix('genomes/{0}/bowtie2/{0}'.format(i))
+        for i in range(100)
+    ] + [aligners.bowtie2_index_from_prefix('x', large=True), 'y.1.bt2']
+    expected = [aligners.prefix_from_bowtie2_index(i) for i in lists]
+    assert aligners.prefixes_from_index(lists, 'bowtie2') == expected
+    assert expected[:2] == ['genomes/0/bowtie2/0', 'genomes/1/bowtie2/1']
+    assert expected[-2:] == ['x', 'y']
+
+    d = {'a': aligners.star_index_from_prefix('idx/a'),
+         'b': aligners.star_index_from_prefix('idx/b')}
+    assert aligners.prefixes_from_index(d, 'star') == {'a': 'idx/a', 'b': 'idx/b'}
+
+    with pytest.raises(ValueError):
+        aligners.prefixes_from_index(
+            [['a/b.1.bt2'], ['a/b.1.bt2', 'z/b.2.bt2']], 'bowtie2')
+
+
+def test_star_index_variant(tmpdir):
+    prefix = str(tmpdir)
+    assert aligners.index_variant(prefix, 'star') is None
+    for fn in aligners.star_index_from_prefix(prefix):
+        open(fn, 'w').close()
+    assert aligners.index_variant(prefix, 'star') == 'small'
+    with pytest.raises(ValueError):
+        aligners.missing_index_files(prefix, 'star', large=True)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import gaussian_kde
+from lcdblib.expression import expression_utils
+
+
+@pytest.fixture(scope='session')
+def log_fpkm():
+    rng = np.random.RandomState(0)
+    n = 5000
+    return pd.DataFrame({
+        'sample%s' % j: np.concatenate([
+            rng.normal(3 + j * 0.2, 1.2, int(n * 0.7)),
+            rng.normal(-2, 1.5, int(n * 0.3))])
+        for j in range(6)
+    }, index=['gene%s' % i for i in range(n)])
+
+
+def test_binned_kde(log_fpkm):
+    x = log_fpkm['sample0'].values
+    xi, yi = expression_utils._binned_kde(x[:, None], resolution=200)
+    expected = gaussian_kde(x).evaluate(xi[0])
+    assert np.allclose(yi[0], expected, atol=1e-4 * expected.max())
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_zFPKM_matrix(log_fpkm, processes):
+    z = expression_utils.zFPKM_matrix(
+        log_fpkm, processes=processes, blocksize=4)
+    assert z.index.equals(log_fpkm.index)
+    assert z.columns.equals(log_fpkm.columns)
+    for col in log_fpkm.columns:
+        expected = expression_utils.zFPKM(log_fpkm[col].values)['z']
+        assert np.allclose(z[col].values, expected)
+
+
+def test_zFPKM_nonfinite(log_fpkm):
+    x = log_fpkm['sample0'].copy()
+    with_zeros = x.copy()
+    with_zeros.iloc[:100] = -np.inf
+    with_zeros.iloc[100:110] = np.nan
+
+    res = expression_utils.zFPKM(with_zeros.values)
+    expected = expression_utils.zFPKM(x.values[110:])
+    assert res['mu'] == expected['mu']
+    assert res['sigma'] == expected['sigma']
+    assert np.isneginf(res['z'][:100]).all()
+    assert np.isnan(res['z'][100:110]).all()
+    assert np.allclose(res['z'][110:], expected['z'])
+
+
+def test_zFPKM_transform(log_fpkm):
+    df = log_fpkm.copy()
+    df.iloc[:100, 0] = -np.inf
+    df.iloc[:, 1] = np.nan
+    z, summary = expression_utils.zFPKM_transform(df)
+
+    assert z.index.equals(df.index)
+    assert z.columns.equals(df.columns)
+    assert list(summary.index) == list(df.columns)
+    assert list(summary.columns) == ['mu', 'U', 'sigma']
+
+    # all-NaN sample can't be fit
+    assert z.iloc[:, 1].isnull().all()
+    assert summary.iloc[1].isnull().all()
+
+    assert np.isneginf(z.iloc[:100, 0]).all()
+    for col in df.columns[[0, 2, 3]]:
+        expected = expression_utils.zFPKM(df[col].values)
+        assert np.allclose(z[col].values, expected['z'])
+        assert np.isclose(summary.loc[col, 'mu'], expected['mu'])
+        assert np.isclose(summary.loc[col, 'U'], expected['U'])
+        assert np.isclose(summary.loc[col, 'sigma'], expected['sigma'])
+
+    zs, summary = expression_utils.zFPKM_transform(df['sample2'])
+    assert isinstance(zs, pd.Series)
+    assert zs.index.equals(df.index)
+    assert zs.equals(z['sample2'])
+    assert list(summary.index) == ['sample2']
@@ -1,3 +1,6 @@
+import os
+import shutil
+import subprocess
 import pytest
 import pandas as pd
 from lcdblib.snakemake import helpers
@@ -61,3 +64,169 @@ def test_fill_patterns_df(patterns):
                ]
 
     assert expected == sorted(res)
+
+
+def test_fill_patterns_order(patterns):
+    fill = dict(sample=['U1', 'T1'], N=[2, 1], unused=['x', 'y'])
+    res = helpers.fill_patterns(patterns, fill)
+
+    assert res['bam'] == [
+        'samples/U1/U1.cutadapt.bam',
+        'samples/T1/T1.cutadapt.bam',
+    ]
+    assert res['fastqc']['raw'] == [
+        'samples/U1/fastqc/U1_R2.fastq.gz_fastqc.zip',
+        'samples/U1/fastqc/U1_R1.fastq.gz_fastqc.zip',
+        'samples/T1/fastqc/T1_R2.fastq.gz_fastqc.zip',
+        'samples/T1/fastqc/T1_R1.fastq.gz_fastqc.zip',
+    ]
+
+
+def test_fill_patterns_df_duplicates(patterns):
+    fill = pd.DataFrame({
+        'sample': ['U2', 'U1', 'U1'],
+        'N': [1, 2, 3],
+        })
+    res = helpers.fill_patterns(patterns, fill)
+    assert res['bam'] == [
+        'samples/U2/U2.cutadapt.bam',
+        'samples/U1/U1.cutadapt.bam',
+    ]
+
+
+def test_fill_patterns_constraints():
+    res = helpers.fill_patterns(
+        {'a': '{sample,[^/]+}/{sample}.bam'}, dict(sample=['x', 'y']))
+    assert res['a'] == ['x/x.bam', 'y/y.bam']
+
+    with pytest.raises(KeyError):
+        helpers.fill_patterns({'a': '{sample}_{N}'}, dict(sample=['x']))
+
+
+def test_fill_patterns_escaped():
+    from itertools import product
+    from snakemake.io import expand
+    res = helpers.fill_patterns({'a': '{{sample}}_{N}'}, {'N': [1, 2]})
+    assert res['a'] == ['{sample}_1', '{sample}_2']
+    assert res['a'] == expand('{{sample}}_{N}', N=[1, 2])
+
+    # Escaped braces next to, and around, wildcards
+    fill = dict(sample=['x', 'y'], N=[1, 2, 3], unused=['u'])
+    assert helpers.fill_patterns({'a': '{{{sample}}}/{N}'}, fill, zip)['a'] \
+        == ['{x}/1', '{y}/2']
+    for pattern in ['{sample}{{N}}', '{{}}{sample}', '{sample}_{N}']:
+        for combination in [product, zip]:
+            assert helpers.fill_patterns(
+                {'a': pattern}, fill, combination)['a'] == \
+                expand(pattern, combination, **fill)
+
+
+def test_fill_patterns_processes():
+    fill = dict(a=list(range(20)), b=list(range(30)), c=['x', 'y'])
+    pattern = {'p': '{a}/{b}/{c}.txt'}
+    expected = helpers.fill_patterns(pattern, fill)['p']
+    res = helpers._fill_pattern(
+        pattern['p'], fill, processes=2, chunksize=100)
+    assert res == expected
+    assert len(res) == 20 * 30 * 2
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_extract_wildcards_many(vectorized):
+    pattern = '{output}/{sample}/{sample}.bam'
+    targets = [
+        'data/a/a.bam',
+        'data/b/b.bam',
+        'data/b/c.bam',
+        'other/data/c/c.bam',
+    ]
+    df = helpers.extract_wildcards_many(pattern, targets, vectorized=vectorized)
+    assert list(df.columns) == ['output', 'sample']
+    assert list(df.index) == targets
+    assert df.loc['data/b/b.bam'].tolist() == ['data', 'b']
+    assert df.loc['data/b/c.bam'].isnull().all()
+    assert df.loc['other/data/c/c.bam'].tolist() == ['other/data', 'c']
+
+    for target in targets:
+        expected = helpers.extract_wildcards(pattern, target)
+        if expected is None:
+            continue
+        assert df.loc[target].to_dict() == expected
+
+    df = helpers.extract_wildcards_many(
+        pattern, targets, vectorized=vectorized, dropna=True)
+    assert list(df.index) == ['data/a/a.bam', 'data/b/b.bam',
+                              'other/data/c/c.bam']
+
+
+@pytest.mark.parametrize('threads', [None, 2])
+def test_scan_wildcards(tmpdir, threads):
+    root = str(tmpdir)
+    for fn in [
+        'samples/a/a.bam',
+        'samples/b/b.bam',
+        'samples/b/c.bam',
+        'samples/c/c.bam.bai',
+        'samples/d.bam',
+        'other/e/e.bam',
+    ]:
+        fn = os.path.join(root, fn)
+        if not os.path.exists(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        open(fn, 'w').close()
+
+    pattern = root + '/samples/{sample}/{sample}.bam'
+    df = helpers.scan_wildcards(pattern, threads=threads)
+    assert list(df.columns) == ['sample']
+    assert list(df.index) == [
+        root + '/samples/a/a.bam',
+        root + '/samples/b/b.bam',
+    ]
+    assert list(df['sample']) == ['a', 'b']
+
+    pattern = root + '/{group,[^/]+}/{sample}/{name}.bam'
+    df = helpers.scan_wildcards(pattern, threads=threads)
+    assert list(df.columns) == ['group', 'sample', 'name']
+    assert df.values.tolist() == [
+        ['other', 'e', 'e'],
+        ['samples', 'a', 'a'],
+        ['samples', 'b', 'b'],
+        ['samples', 'b', 'c'],
+    ]
+
+    orig = os.getcwd()
+    os.chdir(root)
+    try:
+        df = helpers.scan_wildcards('samples/{sample}.bam', threads=threads)
+        assert list(df.index) == ['samples/d.bam']
+        assert len(helpers.scan_wildcards('missing/{sample}.bam')) == 0
+    finally:
+        os.chdir(orig)
+
+
+@pytest.mark.skipif(shutil.which('R') is None, reason='R not installed')
+def test_rsession(tmpdir):
+    t = str(tmpdir)
+    with helpers.RSession() as session:
+        for i in range(3):
+            helpers.rscript(
+                'x <- {0}\nprint(exists("y"))\ny <- x\ncat(x * 2, "\\n")\n'
+                .format(i),
+                os.path.join(t, '{0}.R'.format(i)),
+                log=os.path.join(t, '{0}.log'.format(i)),
+                session=session)
+        for i in range(3):
+            log = open(os.path.join(t, '{0}.log'.format(i))).read()
+            # each script gets a fresh environment
+            assert 'FALSE' in log
+            assert str(i * 2) in log
+
+        with pytest.raises(subprocess.CalledProcessError):
+            helpers.rscript('stop("oops")', os.path.join(t, 'fail.R'),
+                            log=os.path.join(t, 'fail.log'), session=session)
+        assert 'oops' in open(os.path.join(t, 'fail.log')).read()
+
+        # session is still usable after an error
+        helpers.rscript('cat("ok\\n")', os.path.join(t, 'ok.R'),
+                        log=os.path.join(t, 'ok.log'), session=session)
+        assert open(os.path.join(t, 'ok.log')).read() == 'ok\n'
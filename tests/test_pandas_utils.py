@@ -42,3 +42,102 @@ def test_cartesian_dict(sample_table):
     test_sf = pd.Series({'sample': 'one', 'tissue': 'ovary', 'num': 100}, name='').sort_index()
     assert sf.equals(test_sf)
     assert result.shape == (4, 3)
+
+
+def test_tidy_dataframe():
+    df = pd.DataFrame({
+        'gene': ['g1|g2', 'g3', None, 'g4|g5|g6'],
+        'score': [1, 5, 7, 9]},
+        index=['a', 'b', 'c', 'a'])
+    result = utils.tidy_dataframe(df, 'gene')
+    assert list(result.index) == ['a', 'a', 'b', 'a', 'a', 'a']
+    assert list(result.gene) == ['g1', 'g2', 'g3', 'g4', 'g5', 'g6']
+    assert list(result.score) == [1, 1, 5, 9, 9, 9]
+    assert result.score.dtype == df.score.dtype
+
+    # original is untouched
+    assert df.gene[0] == 'g1|g2'
+
+
+def test_tidy_dataframe_multiple():
+    df = pd.DataFrame({
+        'gene': ['g1;g2', 'g3'],
+        'symbol': ['A;B', 'C'],
+        'score': [1, 5]})
+    result = utils.tidy_dataframe(df, ['gene', 'symbol'], sep=';')
+    assert list(result.gene) == ['g1', 'g2', 'g3']
+    assert list(result.symbol) == ['A', 'B', 'C']
+    assert list(result.index) == [0, 0, 1]
+
+    df.loc[1, 'symbol'] = 'C;D'
+    with pytest.raises(ValueError):
+        utils.tidy_dataframe(df, ['gene', 'symbol'], sep=';')
+
+
+def test_cartesian_dtypes(sample_table):
+    df2 = pd.DataFrame({'num': [100, 200, 300], 'frac': [0.1, 0.2, 0.3]})
+    result = utils.cartesian_product(sample_table, df2)
+    assert result.shape == (6, 4)
+    assert list(result.columns) == ['sample', 'tissue', 'num', 'frac']
+    assert result.num.dtype == df2.num.dtype
+    assert result.frac.dtype == df2.frac.dtype
+    assert list(result['sample']) == ['one'] * 3 + ['two'] * 3
+    assert list(result['num']) == [100, 200, 300] * 2
+    assert list(result.index) == list(range(6))
+
+
+def test_cartesian_chunks(sample_table):
+    df1 = pd.concat([sample_table] * 3, ignore_index=True).iloc[:5]
+    df2 = {'num': [100, 200]}
+    expected = utils.cartesian_product(df1, df2)
+    chunks = list(utils.cartesian_product(df1, df2, chunksize=4))
+    assert [len(i) for i in chunks] == [4, 4, 2]
+    assert pd.concat(chunks).equals(expected)
+
+
+@pytest.fixture
+def annotation_file(tmpdir):
+    df = pd.DataFrame({
+        'gene': ['g%d|g%d' % (i, i + 1) if i % 3 else 'g%d' % i
+                 for i in range(20)],
+        'score': range(20)})
+    fn = str(tmpdir.join('annotation.tsv'))
+    df.to_csv(fn, sep='\t', index=False)
+    return fn
+
+
+def test_tidy_dataframe_chunks(annotation_file):
+    expected = utils.tidy_dataframe(
+        pd.read_csv(annotation_file, sep='\t'), 'gene')
+    chunks = pd.read_csv(annotation_file, sep='\t', chunksize=6)
+    result = pd.concat(utils.tidy_dataframe_chunks(chunks, 'gene'))
+    assert result.equals(expected)
+
+
+def test_cartesian_product_chunks(annotation_file):
+    df2 = {'num': [1, 2, 3]}
+    expected = utils.cartesian_product(
+        pd.read_csv(annotation_file, sep='\t'), df2)
+    for chunksize in [None, 4]:
+        chunks = pd.read_csv(annotation_file, sep='\t', chunksize=6)
+        result = pd.concat(
+            utils.cartesian_product_chunks(chunks, df2, chunksize=chunksize))
+        assert result.equals(expected)
+
+
+@pytest.mark.parametrize('ext', ['tsv', 'csv.gz', 'parquet'])
+def test_write_chunks(annotation_file, tmpdir, ext):
+    if ext == 'parquet':
+        pytest.importorskip('pyarrow')
+    expected = utils.tidy_dataframe(
+        pd.read_csv(annotation_file, sep='\t'), 'gene')
+    chunks = pd.read_csv(annotation_file, sep='\t', chunksize=6)
+    fn = str(tmpdir.join('tidy.' + ext))
+    n = utils.write_chunks(
+        utils.tidy_dataframe_chunks(chunks, 'gene'), fn, index=False)
+    assert n == len(expected)
+    if ext == 'parquet':
+        result = pd.read_parquet(fn)
+    else:
+        result = pd.read_csv(fn, sep='\t' if ext == 'tsv' else ',')
+    assert result.equals(expected.reset_index(drop=True))
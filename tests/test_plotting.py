@@ -1,8 +1,10 @@
 import matplotlib
 matplotlib.use('agg')
+from matplotlib import pyplot as plt
 from lcdblib.plotting import results_table
 import pytest
 from textwrap import dedent
+import numpy as np
 import pandas
 from io import StringIO
 import pybedtools
@@ -95,6 +97,17 @@ def test_up_down(deseq_results):
     assert list(r.downregulated(alpha=0.01, lfc=-3.5, idx=False).index) == ['g2']
 
 
+def test_align_with(rt):
+    other = rt.data.iloc[::-1]
+    assert rt.align_with(other).data.equals(other)
+    other = pandas.DataFrame(index=['g2', 'x'], columns=['padj', 'y'])
+    aligned = rt.align_with(other)
+    assert list(aligned.index) == ['g2', 'x']
+    assert list(aligned.columns) == ['padj', 'y']
+    assert aligned.data.loc['x'].isnull().all()
+    assert aligned.data.loc['g2', 'padj'] == rt.data.loc['g2', 'padj']
+
+
 def test_reindex_to(rt):
     r2 = rt.reindex_to(
         pybedtools.BedTool(
@@ -158,14 +171,444 @@ def test_copy(rt):
     assert sum(rt.padj > 0)
 
 
+def test_lazy_views(deseq_results):
+    r = results_table.DESeq2Results(deseq_results)
+    base = r.data
+    up = r[r.baseMean > 1].upregulated(idx=False)[:3]
+    assert up._base is base
+    assert list(up.index) == ['g1', 'g3', 'g5']
+    assert len(up) == 3
+    assert isinstance(up, results_table.DESeq2Results)
+
+    # Writes to a view never reach its parent...
+    up.data['padj'] = 1
+    assert (r.data.loc[['g1', 'g3', 'g5'], 'padj'] < 1).all()
+
+    # ...and writes to the parent never reach an existing view
+    dn = r.downregulated(idx=False)
+    r.data['log2FoldChange'] = 0
+    assert (dn.data['log2FoldChange'] < 0).all()
+
+    # Boolean arrays and Series index the same way as DataFrames do
+    r = results_table.DESeq2Results(deseq_results)
+    mask = (deseq_results.baseMean > 10).values
+    assert r[mask].data.equals(deseq_results[mask])
+    assert r[list(mask)].data.equals(deseq_results[mask])
+    assert r[['baseMean', 'padj']].data.equals(
+        deseq_results[['baseMean', 'padj']])
+
+    assert list(r.unchanged(idx=False).index) == list(
+        deseq_results.index[~r.changed()])
+
+
+def test_lazy_reads(deseq_results):
+    r = results_table.DESeq2Results(deseq_results)
+    base = r.data
+    up = r.upregulated(idx=False)
+    c = r.copy()
+
+    # Reading a parent after subsetting it doesn't copy it
+    r.baseMean
+    r['padj']
+    r.index
+    r.sort_values('padj')
+    r.ma_plot(0.1)
+    assert r._base is base
+    assert c._base is base
+
+    # Nor does reading columns or the index of a view
+    assert (up.log2FoldChange > 0).all()
+    up.index
+    assert up._base is base and up._rows is not None
+
+    # Writing through `data` still copies
+    r.data['padj'] = 1
+    assert r._base is not base
+    assert c['padj'].equals(deseq_results['padj'])
+
+
+def test_lazy_writes(deseq_results):
+    r = results_table.DESeq2Results(deseq_results.copy())
+    padj = r.data['padj'].copy()
+
+    # Writes through a copy don't reach the original...
+    c = r.copy()
+    c.loc['g1', 'padj'] = 99
+    c.at['g2', 'padj'] = 99
+    c.iloc[2, c.columns.get_loc('padj')] = 99
+    c.fillna(0, inplace=True)
+    c.padj[3] = 99
+    assert r['padj'].equals(padj)
+    assert c.loc['g1', 'padj'] == 99
+
+    # ...nor do writes to the original reach an existing subset
+    sub = r[r.baseMean > 0]
+    r.loc['g1', 'padj'] = 42
+    r.sort_values('padj', inplace=True)
+    assert sub.loc['g1', 'padj'] == padj['g1']
+    assert list(sub.index) == list(deseq_results.index[
+        deseq_results.baseMean > 0])
+
+
 def test_features(gffdb, rt):
     rt.attach_db(gffdb)
     assert len(pybedtools.BedTool(rt.features())) == 25
 
 
+def test_features_bulk(gffdb, rt):
+    rt.attach_db(gffdb)
+    expected = [str(gffutils.helpers.asinterval(gffdb[i])) for i in rt.index]
+    assert [str(i) for i in rt.features(chunksize=7)] == expected
+    bt = rt.features(bedtool=True)
+    assert isinstance(bt, pybedtools.BedTool)
+    assert [str(i) for i in bt] == expected
+
+    missing = rt.update(rt.data.reindex(['g2', 'x', 'g1']))
+    with pytest.raises(gffutils.FeatureNotFoundError):
+        list(missing.features())
+    assert [i.name for i in missing.features(ignore_unknown=True)] == \
+        ['g2', 'g1']
+
+
+def test_feature_coordinates(gffdb, rt):
+    rt.attach_db(gffdb)
+    coords = rt.feature_coordinates(chunksize=4)
+    assert list(coords.index) == list(rt.index)
+    assert list(coords.columns) == ['chrom', 'start', 'end', 'strand']
+    assert coords.loc['g1'].tolist() == ['chr1', 0, 10, '+']
+    assert coords.loc['g25'].tolist() == ['chr3', 74, 100, '+']
+
+    missing = rt.update(rt.data.reindex(['g2', 'x']))
+    with pytest.raises(gffutils.FeatureNotFoundError):
+        missing.feature_coordinates()
+    assert list(missing.feature_coordinates(ignore_unknown=True).index) == \
+        ['g2']
+
+
 def test_scatter(rt):
     # just a smoke test
     rt.scatter(
         x='padj',
         y='baseMean'
     )
+
+
+def test_scatter_fast(rt):
+    from matplotlib.backend_bases import MouseEvent
+    clicked = []
+    up = rt.log2FoldChange > 0
+    ax = rt.scatter(
+        x='baseMean', y='log2FoldChange', fast=True,
+        genes_to_highlight=[(up, dict(color='r', label='up', s=30))],
+        callback=clicked.append, rasterize_threshold=10)
+
+    # One collection per style, plus an empty legend proxy
+    colls = [c for c in ax.collections
+             if isinstance(c, matplotlib.collections.PathCollection)]
+    assert [len(c.get_offsets()) for c in colls] == [0, 11, 6]
+    assert colls[1].get_rasterized()
+    assert tuple(colls[2].get_facecolors()[0]) == (1, 0, 0, 0.2)
+    assert (colls[2].get_sizes() == 30).all()
+
+    ax.figure.canvas.draw()
+    px, py = ax.transData.transform((rt.baseMean['g6'], rt.log2FoldChange['g6']))
+    event = MouseEvent('button_press_event', ax.figure.canvas, px, py, 1)
+    ax.figure.canvas.callbacks.process('button_press_event', event)
+    assert clicked[0] == 'g6'
+    assert ax.fast_picker.pick(px + 500, py + 500) == []
+
+    # A second fast scatter of the same table keeps its own picker
+    fig, (ax1, ax2) = plt.subplots(1, 2)
+    clicked = []
+    rt.scatter(x='baseMean', y='log2FoldChange', fast=True, ax=ax1,
+               callback=clicked.append)
+    rt.scatter(x='baseMean', y='padj', fast=True, ax=ax2,
+               callback=clicked.append)
+    fig.canvas.draw()
+    px, py = ax1.transData.transform(
+        (rt.baseMean['g6'], rt.log2FoldChange['g6']))
+    event = MouseEvent('button_press_event', fig.canvas, px, py, 1)
+    fig.canvas.callbacks.process('button_press_event', event)
+    assert clicked[:1] == ['g6']
+
+    with pytest.raises(ValueError):
+        rt.scatter(x='baseMean', y='log2FoldChange', fast=True,
+                   marginal_histograms=True)
+
+
+def test_scatter_density(deseq_results):
+    r = results_table.DESeq2Results(deseq_results)
+    up = r.upregulated()
+    ax = r.ma_plot(0.1, density=True, gridsize=(10, 5),
+                   marginal_histograms=True)
+    counts = r.density_counts
+    assert counts.shape == (10, 5)
+
+    # Only non-highlighted points with finite values are in the image
+    valid = np.isfinite(np.log(r.baseMean)) & np.isfinite(r.log2FoldChange)
+    background = valid & ~up & ~r.downregulated()
+    assert counts.sum() == background.sum()
+    assert r.density_image in ax.images
+
+    # Marginals come from the same bins
+    assert len(r.marginal.top_hists) == 3
+    edges, xcounts = r.marginal.hxs[0]
+    assert len(edges) == 11
+    assert (xcounts == counts.sum(axis=1)).all()
+    assert r.marginal.hxs[1][1].sum() == (up & valid).sum()
+
+    # Highlighted points are drawn individually
+    offsets = [len(c.get_offsets()) for c in ax.collections
+               if isinstance(c, matplotlib.collections.PathCollection)]
+    assert offsets == [(up & valid).sum(), (r.downregulated() & valid).sum()]
+
+
+def test_radviz():
+    rng = np.random.RandomState(0)
+    df = pandas.DataFrame(rng.rand(20, 3), columns=['a', 'b', 'c'],
+                          index=['g%d' % i for i in range(20)])
+    df.iloc[0] = df.min()
+    r = results_table.ResultsTable(df)
+    ax = r.radviz(['a', 'b', 'c'], transforms={'c': np.log1p})
+    assert list(r.data.columns) == ['a', 'b', 'c']
+    assert ax.get_xlabel() == 'radviz_x'
+
+    # Per-row reference, as in pandas.plotting.radviz
+    x = df.copy()
+    x['c'] = np.log1p(x['c'])
+    x = (x - x.min()) / (x.max() - x.min())
+    t = 2 * np.pi * np.arange(3) / 3.
+    s = np.column_stack([np.cos(t), np.sin(t)])
+    expected = np.array([(s * row[:, None]).sum(axis=0) / row.sum()
+                         for row in x.values[1:]])
+    xy, anchors = results_table._radviz_coordinates(x.values)
+    assert np.allclose(anchors, s)
+    assert np.allclose(xy[1:], expected)
+
+    # All-minimum rows have no position
+    assert np.isnan(xy[0]).all()
+    points = ax.collections[0].get_offsets()
+    assert len(points) == 19
+
+
+def test_coordinate_cache(gff, rt, tmpdir, monkeypatch):
+    fn = str(tmpdir.join('test.db'))
+    gffutils.create_db(gff, fn)
+    results_table.clear_coordinate_cache()
+    rt1 = results_table.ResultsTable(rt.data, db=fn)
+    rt2 = results_table.ResultsTable(rt.data[::-1], db=fn)
+    c1 = rt1.feature_coordinates(sidecar=True)
+    c2 = rt2.feature_coordinates(sidecar=True)
+    assert c1.loc['g1'].tolist() == ['chr1', 0, 10, '+']
+    assert c2.index.equals(rt.data.index[::-1])
+    assert c2.loc[c1.index].equals(c1)
+    assert len(results_table._coordinate_cache) == 1
+    assert results_table.db_coordinates(fn) is \
+        results_table.db_coordinates(fn)
+    assert rt1._cached_features is not None
+
+    # Sidecar is used once the in-memory cache is cleared
+    sidecars = tmpdir.listdir(lambda p: p.basename.endswith('.parquet'))
+    assert len(sidecars) == 1
+    results_table.clear_coordinate_cache()
+    c3 = results_table.ResultsTable(rt.data, db=fn).feature_coordinates(
+        sidecar=True)
+    assert c3.equals(c1)
+
+    bed = rt1.features(bed=True, bedtool=True)
+    assert str(bed[0]).split('\t') == ['chr1', '0', '10', 'g1', '0', '+\n']
+
+    # Restricted to feature types
+    assert rt1.feature_coordinates(featuretype='gene').equals(c1)
+    assert rt1.feature_coordinates(
+        featuretype=['exon'], ignore_unknown=True).empty
+    assert len(results_table._coordinate_cache) == 3
+
+    # Attaching another db replaces the coordinates
+    fn2 = str(tmpdir.join('test2.db'))
+    gffutils.create_db(pybedtools.BedTool(
+        'chrX . gene 1 10 . + . ID="g1"', from_string=True).fn, fn2)
+    rt1.attach_db(fn2)
+    c4 = rt1.feature_coordinates(ignore_unknown=True)
+    assert c4.loc['g1'].tolist() == ['chrX', 0, 10, '+']
+    assert len(c4) == 1
+
+    # The cache is bounded by size
+    monkeypatch.setattr(results_table, 'COORDINATE_CACHE_BYTES',
+                        results_table.db_coordinates(fn)
+                        .memory_usage(deep=True).sum())
+    results_table.clear_coordinate_cache()
+    results_table.db_coordinates(fn)
+    results_table.db_coordinates(fn2)
+    assert [i[0] for i in results_table._coordinate_cache] == [
+        fn2]
+
+
+@pytest.mark.parametrize('cache', ['feather', 'parquet'])
+def test_cached_loading(deseq_results, tmpdir, cache):
+    fn = str(tmpdir.join('results.tsv'))
+    deseq_results.to_csv(fn, sep='\t')
+    r1 = results_table.DESeq2Results(fn, cache=cache, stats_dtype='float32')
+    cached = tmpdir.listdir(lambda p: p.basename.endswith('.' + cache))
+    assert len(cached) == 1
+    assert r1.data['padj'].dtype == 'float32'
+    assert r1.data.index.equals(deseq_results.index)
+
+    # Second load reads the cache
+    r2 = results_table.DESeq2Results(fn, cache=cache, stats_dtype='float32')
+    assert r2.data.equals(r1.data)
+    assert len(tmpdir.listdir(
+        lambda p: p.basename.endswith('.' + cache))) == 1
+
+    # Different options get a different cache file
+    r3 = results_table.DESeq2Results(
+        fn, cache=cache, usecols=['baseMean', 'log2FoldChange', 'padj'])
+    assert list(r3.data.columns) == ['baseMean', 'log2FoldChange', 'padj']
+    assert r3.data.index.equals(deseq_results.index)
+    assert r3.data['padj'].dtype == 'float64'
+    assert list(r3.upregulated(idx=False).index) == ['g1', 'g3', 'g5', 'g18']
+    assert len(tmpdir.listdir(
+        lambda p: p.basename.endswith('.' + cache))) == 2
+
+
+def test_usecols_unnamed_index(deseq_results, tmpdir):
+    # DESeq2's write.table output has no header field for the index
+    fn = str(tmpdir.join('results.tsv'))
+    with open(fn, 'w') as fout:
+        fout.write('\t'.join(deseq_results.columns) + '\n')
+        deseq_results.to_csv(fout, sep='\t', header=False)
+    r = results_table.DESeq2Results(fn, usecols=['log2FoldChange', 'padj'])
+    assert list(r.data.columns) == ['log2FoldChange', 'padj']
+    assert r.data.index.equals(deseq_results.index)
+
+
+def test_contrast_store(deseq_results, tmpdir):
+    r1 = results_table.DESeq2Results(deseq_results)
+    shuffled = deseq_results.iloc[::-1].copy()
+    shuffled['log2FoldChange'] *= -1
+    r2 = results_table.DESeq2Results(shuffled.drop('g1'))
+    store = results_table.ContrastStore.from_results(dict(a=r1, b=r2))
+    assert len(store) == 2
+    assert list(store.contrasts) == ['a', 'b']
+    assert store.index.equals(deseq_results.index)
+    assert store.lfc.loc['g2', 'b'] == 3.802
+    assert np.isnan(store.pval.loc['g1', 'b'])
+
+    for name, r in [('a', r1), ('b', r2)]:
+        for method in ['changed', 'unchanged', 'upregulated', 'downregulated']:
+            expected = getattr(r, method)(alpha=0.05, lfc=1)
+            if method == 'unchanged':
+                # Missing genes are not changed
+                expected = expected.reindex(store.index, fill_value=True)
+            else:
+                expected = expected.reindex(store.index, fill_value=False)
+            got = getattr(store, method)(alpha=0.05, lfc=1)[name]
+            assert got.equals(expected.rename(name))
+
+    # Integer columns still give NaN for missing genes
+    rounded = shuffled.drop('g1')
+    rounded['baseMean'] = rounded['baseMean'].round().astype(int)
+    store2 = results_table.ContrastStore.from_results(
+        dict(a=r1, b=results_table.DESeq2Results(rounded)))
+    assert store2.mean['b'].dtype == float
+    assert np.isnan(store2.mean.loc['g1', 'b'])
+    assert store2.mean.loc['g2', 'b'] == rounded.loc['g2', 'baseMean']
+
+    n_up = (store.upregulated() | store.downregulated()).sum(axis=1)
+    assert n_up['g2'] == 2
+
+    fn = str(tmpdir.join('store.parquet'))
+    store.save(fn)
+    loaded = results_table.ContrastStore.load(fn)
+    assert loaded.pval.equals(store.pval)
+    assert loaded.lfc.equals(store.lfc)
+    assert loaded.mean.equals(store.mean)
+
+    fn_a = str(tmpdir.join('a.tsv'))
+    deseq_results.to_csv(fn_a, sep='\t')
+    fromfile = results_table.ContrastStore.from_files(
+        dict(a=fn_a), stats_dtype='float32')
+    assert fromfile.lfc['a'].dtype == 'float32'
+    assert np.allclose(fromfile.lfc['a'], store.lfc['a'], equal_nan=True)
+
+
+def test_lazy_dict(deseq_results, tmpdir):
+    fns = {}
+    for i in range(4):
+        fn = str(tmpdir.join('%d.tsv' % i))
+        deseq_results.iloc[i:].iloc[::-1].to_csv(fn, sep='\t')
+        fns[i] = fn
+    d = results_table.LazyDict(
+        fns, index_from=0, cls=results_table.DESeq2Results, threads=2)
+
+    # Previously raised KeyError for keys not yet loaded
+    values = d.values()
+    assert len(values) == 4
+    for v in values:
+        assert list(v.index) == list(deseq_results.index[::-1])
+    assert np.isnan(d[3].data.loc['g1', 'padj'])
+    assert [k for k, v in d.items()] == [0, 1, 2, 3]
+    assert d[2] is values[2]
+
+    # Eviction keeps only what fits, plus the most recent
+    d = results_table.LazyDict(
+        fns, index_from=0, cls=results_table.DESeq2Results, max_memory=1)
+    for k in fns:
+        d[k]
+    assert list(d._dict.keys()) == [3]
+    d[1]
+    assert list(d._dict.keys()) == [1]
+    d.max_memory = sum(d._sizes.values()) * 10
+    d[2]
+    d[3]
+    d[2]
+    assert list(d._dict.keys()) == [1, 3, 2]
+    d.max_memory = 1
+    d[0]
+    assert list(d._dict.keys()) == [0]
+
+    futures = d.prefetch([1, 3])
+    assert sorted(futures) == [1, 3]
+    for f in futures.values():
+        f.result()
+    # Waits for the callbacks that store results
+    d.close()
+    assert len(d._dict) == 1
+
+    with pytest.raises(KeyError):
+        d['missing']
+
+    # Iterating loads each file once, even if they don't all fit in memory
+    d = results_table.LazyDict(
+        fns, index_from=0, cls=results_table.DESeq2Results, threads=2,
+        max_memory=1)
+    loads = []
+    load = d._load
+    d._load = lambda key: loads.append(key) or load(key)
+    values = d.values()
+    d.close()
+    assert sorted(loads) == [0, 1, 2, 3]
+    assert [list(v.index) for v in values] == \
+        [list(deseq_results.index[::-1])] * 4
+    assert len(d._dict) == 1
+
+
+def test_threshold_summary(deseq_results):
+    r = results_table.DESeq2Results(deseq_results)
+    alphas = [0.1, 1e-300, 0.05, 0]
+    lfcs = [1, 0, 3.5]
+    summary, sets = r.threshold_summary(alphas, lfcs, index=True)
+    assert list(summary.columns) == ['alpha', 'lfc', 'up', 'down', 'changed']
+    assert len(summary) == 12
+    for _, row in summary.iterrows():
+        alpha, lfc = row['alpha'], row['lfc']
+        up = r.upregulated(alpha, lfc)
+        dn = r.downregulated(alpha, -lfc)
+        ch = r.changed(alpha, lfc)
+        assert row['up'] == up.sum()
+        assert row['down'] == dn.sum()
+        assert row['changed'] == ch.sum()
+        assert list(sets[(alpha, lfc)]['up']) == list(r.index[up])
+        assert list(sets[(alpha, lfc)]['down']) == list(r.index[dn])
+        assert list(sets[(alpha, lfc)]['changed']) == list(r.index[ch])
+    assert summary.iloc[0].tolist() == [0.1, 1, 4, 4, 8]
@@ -1,5 +1,8 @@
 from textwrap import dedent
+import pytest
 import numpy as np
+import pandas as pd
+from scipy.stats import fisher_exact
 from lcdblib.stats import fisher
 
 table = [12, 5, 29, 2]
@@ -74,3 +77,138 @@ def test_fisher_tables():
     odds ratio: 0.165517
     2-sided pval: 0.0802686
     """)
+
+
+def test_fisher_many():
+    rng = np.random.RandomState(0)
+    tables = rng.randint(0, 30, size=(500, 4))
+    tables[:10, 0] = 0
+    tables[10:20, :2] = 0
+    tables[20] = table
+    for alternative in ['two-sided', 'less', 'greater']:
+        oddsratio, pval = fisher.fisher_many(tables, alternative=alternative)
+        for t, o, p in zip(tables, oddsratio, pval):
+            expected_o, expected_p = fisher_exact(
+                t.reshape(2, 2), alternative=alternative)
+            assert np.isclose(p, expected_p)
+            assert np.isclose(o, expected_o, equal_nan=True)
+
+    oddsratio, pval = fisher.fisher_many([table])
+    assert np.allclose((oddsratio[0], pval[0]), fisher.fisher(table))
+
+
+def test_bh_fdr():
+    pvals = np.array([0.01, 0.04, 0.03, np.nan, 0.2])
+    expected = [0.04, 0.04 * 4 / 3, 0.04 * 4 / 3, np.nan, 0.2]
+    assert np.allclose(fisher.bh_fdr(pvals), expected,
+                       equal_nan=True)
+
+    _, pval, padj = fisher.fisher_many([table, table], fdr=True)
+    assert np.allclose(padj, pval)
+
+
+def test_table_from_bool_matrix():
+    rng = np.random.RandomState(0)
+    ind = rng.rand(1000) > 0.7
+    others = rng.rand(1000, 5) > 0.4
+    tables = fisher.table_from_bool_matrix(ind, others)
+    assert tables.shape == (5, 4)
+    for i in range(5):
+        assert list(tables[i]) == fisher.table_from_bool(ind, others[:, i])
+        assert sum(tables[i]) == 1000
+
+    df = pd.DataFrame(others, columns=list('abcde'))
+    tables = fisher.table_from_bool_matrix(pd.Series(ind), df)
+    assert list(tables.index) == list('abcde')
+    assert list(tables.loc['c']) == fisher.table_from_bool(ind, others[:, 2])
+
+
+def test_gene_set_enrichment():
+    from lcdblib.stats import enrichment
+    rng = np.random.RandomState(0)
+    genes = np.array(['g%d' % i for i in range(300)], dtype=object)
+    sets = {
+        's%d' % i: rng.choice(genes, rng.randint(1, 60), replace=False)
+        for i in range(40)
+    }
+    sets['empty'] = []
+    gs = enrichment.GeneSets(sets)
+    assert len(gs) == 41
+    background = pd.Index(genes[:250])
+    selected = list(genes[:40]) + ['not_a_gene']
+    res = gs.enrich(selected, background=background, min_size=0)
+    assert res['pval'].is_monotonic_increasing
+    for name, members in sets.items():
+        in_set = background.isin(members)
+        is_sel = background.isin(selected)
+        t = fisher.table_from_bool(in_set, is_sel)
+        assert res.loc[name, ['t11', 't12', 't21', 't22']].tolist() == t
+        assert np.isclose(
+            res.loc[name, 'pval'], fisher_exact(
+                [t[:2], t[2:]], alternative='greater')[1])
+
+    assert 'empty' not in gs.enrich(selected).index
+    mask = pd.Series(False, index=genes)
+    mask[:40] = True
+    assert gs.enrich(mask).equals(gs.enrich(genes[:40]))
+
+    long = pd.DataFrame(
+        [(g, name) for name, members in sets.items() for g in members],
+        columns=['gene', 'set'])
+    gs2 = enrichment.GeneSets.from_dataframe(long, 'gene', 'set')
+    assert list(gs2.names) == [i for i in sets if len(sets[i])]
+    assert gs2.enrich(selected).equals(
+        gs.enrich(selected).drop('empty', errors='ignore'))
+
+    report = enrichment.enrichment_report(res, top=2)
+    assert report.count('odds ratio') == 2
+    assert res.index[0] in report
+
+
+def test_permutation_test():
+    rng = np.random.RandomState(0)
+    ind1 = rng.rand(500) < 0.3
+    ind2 = rng.rand(500) < 0.4
+    oddsratio, pval, null = fisher.permutation_test(
+        ind1, ind2, n_permutations=2500, seed=1, blocksize=1000,
+        return_null=True)
+    assert oddsratio == fisher.fisher(fisher.table_from_bool(ind1, ind2))[0]
+    assert len(null) == 2500
+    assert 0 < pval <= 1
+    assert abs(null.mean() - ind1.sum() * ind2.sum() / 500.) < 1
+
+    # Same seed and blocksize give the same shuffles, with or without
+    # worker processes
+    null2 = fisher.permutation_test(
+        ind1, ind2, n_permutations=2500, seed=1, blocksize=1000,
+        processes=2, return_null=True)[2]
+    assert np.array_equal(null, null2)
+
+    # Shuffling only within strata keeps overlap fixed when both indicators
+    # are constant within each stratum.
+    strata = np.repeat(['a', 'b'], 250)
+    ind = strata == 'a'
+    oddsratio, pval, null = fisher.permutation_test(
+        ind, ind, n_permutations=100, strata=strata, seed=0,
+        return_null=True)
+    assert (null == 250).all()
+    assert pval == 1
+
+    # ...whereas unstratified shuffles make that overlap extreme
+    pval = fisher.permutation_test(
+        ind, ind, n_permutations=100, alternative='greater', seed=0)[1]
+    assert pval == 1 / 101.
+
+    # Missing strata are rejected rather than treated as a stratum
+    covariate = rng.rand(500)
+    covariate[:3] = np.nan
+    for alternative in ['two-sided', 'greater']:
+        with pytest.raises(ValueError):
+            fisher.permutation_test(
+                ind1, ind2, n_permutations=10, strata=covariate, bins=5,
+                alternative=alternative)
+        with pytest.raises(ValueError):
+            fisher.permutation_test(
+                ind1, ind2, n_permutations=10,
+                strata=np.where(covariate > 0.5, 'a', None),
+                alternative=alternative)